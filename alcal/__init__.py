@@ -0,0 +1 @@
+"""Drink bill splitting: storage, menus and settlement, independent of the UI."""
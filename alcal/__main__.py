@@ -0,0 +1,5 @@
+import sys
+
+from alcal.cli import main
+
+sys.exit(main())
@@ -0,0 +1,208 @@
+"""Closing events: move their rows into an archive database and compact."""
+
+from __future__ import annotations
+
+import sqlite3
+from pathlib import Path
+
+from alcal.storage import delete_event_rows, fetch_event_totals, prune_changes
+
+ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS archive.events (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    created_at TIMESTAMP,
+    closed_at TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS archive.participants (
+    id INTEGER PRIMARY KEY,
+    event_id INTEGER NOT NULL,
+    name TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS archive.orders (
+    id INTEGER PRIMARY KEY,
+    event_id INTEGER NOT NULL,
+    drink_name TEXT NOT NULL,
+    unit_price REAL NOT NULL,
+    quantity INTEGER NOT NULL,
+    memo TEXT,
+    category TEXT,
+    input_mode TEXT,
+    created_at TIMESTAMP,
+    payer_id INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS archive.order_shares (
+    order_id INTEGER NOT NULL,
+    participant_id INTEGER NOT NULL,
+    event_id INTEGER NOT NULL,
+    PRIMARY KEY (order_id, participant_id)
+);
+
+CREATE TABLE IF NOT EXISTS archive.order_log (
+    seq INTEGER PRIMARY KEY,
+    event_id INTEGER NOT NULL,
+    order_id INTEGER NOT NULL,
+    action TEXT NOT NULL,
+    before_state TEXT,
+    after_state TEXT,
+    undoes INTEGER,
+    created_at TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS archive.event_totals (
+    event_id INTEGER NOT NULL,
+    participant_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    orders INTEGER NOT NULL,
+    amount REAL NOT NULL,
+    yen INTEGER NOT NULL,
+    PRIMARY KEY (event_id, participant_id)
+);
+
+CREATE INDEX IF NOT EXISTS archive.idx_orders_event ON orders (event_id, created_at, id);
+CREATE INDEX IF NOT EXISTS archive.idx_order_shares_event ON order_shares (event_id, order_id);
+CREATE INDEX IF NOT EXISTS archive.idx_participants_event ON participants (event_id);
+"""
+
+# Tables copied row for row, with the columns shared by both schemas.
+ARCHIVED_TABLES = {
+    "participants": ("id", "event_id", "name"),
+    "orders": (
+        "id",
+        "event_id",
+        "drink_name",
+        "unit_price",
+        "quantity",
+        "memo",
+        "category",
+        "input_mode",
+        "created_at",
+        "payer_id",
+    ),
+    "order_shares": ("order_id", "participant_id", "event_id"),
+    "order_log": (
+        "seq",
+        "event_id",
+        "order_id",
+        "action",
+        "before_state",
+        "after_state",
+        "undoes",
+        "created_at",
+    ),
+}
+
+
+def archive_path_for(db_path: str | Path) -> Path:
+    """Default archive next to the live database: ``foo.db`` -> ``foo_archive.db``."""
+    path = Path(db_path)
+    return path.with_name(f"{path.stem}_archive{path.suffix}")
+
+
+def _final_totals(conn: sqlite3.Connection, event_id: int) -> list[tuple]:
+    totals = fetch_event_totals(conn, event_id)
+    order_counts = dict(
+        conn.execute(
+            """
+            SELECT participant_id, COUNT(*) FROM order_shares
+            WHERE event_id = ?
+            GROUP BY participant_id
+            """,
+            (event_id,),
+        ).fetchall()
+    )
+    return [
+        (event_id, participant_id, name, order_counts.get(participant_id, 0), amount, yen)
+        for participant_id, name, amount, yen in zip(
+            totals["participant_id"].tolist(),
+            totals["name"].tolist(),
+            totals["amount"].tolist(),
+            totals["yen"].tolist(),
+        )
+    ]
+
+
+def close_event(
+    conn: sqlite3.Connection, event_id: int, archive_path: str | Path
+) -> tuple[bool, str | None]:
+    """Archive an event's rows, keep only its final totals and compact the database.
+
+    The rows are first committed to the archive and only then deleted here,
+    so an interrupted close leaves the event open with a harmless extra copy
+    (the next close overwrites it). Hourly rollups are kept, so reports
+    still cover closed events.
+    """
+    event = conn.execute(
+        "SELECT id, closed_at FROM events WHERE id = ?", (event_id,)
+    ).fetchone()
+    if event is None:
+        return False, "イベントが見つかりません。"
+    if event["closed_at"] is not None:
+        return False, "このイベントはすでに終了しています。"
+
+    totals = _final_totals(conn, event_id)
+    conn.execute("ATTACH DATABASE ? AS archive", (str(archive_path),))
+    try:
+        conn.executescript(ARCHIVE_SCHEMA)
+        archived_columns = {
+            row["name"] for row in conn.execute("PRAGMA archive.table_info(orders)")
+        }
+        if "payer_id" not in archived_columns:
+            # Archives written before payers were tracked.
+            conn.execute("ALTER TABLE archive.orders ADD COLUMN payer_id INTEGER")
+        with conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO archive.events (id, name, created_at, closed_at)
+                SELECT id, name, created_at, CURRENT_TIMESTAMP FROM main.events WHERE id = ?
+                """,
+                (event_id,),
+            )
+            for table, columns in ARCHIVED_TABLES.items():
+                column_list = ", ".join(columns)
+                conn.execute(
+                    f"""
+                    INSERT OR REPLACE INTO archive.{table} ({column_list})
+                    SELECT {column_list} FROM main.{table} WHERE event_id = ?
+                    """,
+                    (event_id,),
+                )
+            conn.execute("DELETE FROM archive.event_totals WHERE event_id = ?", (event_id,))
+            conn.executemany(
+                "INSERT INTO archive.event_totals VALUES (?, ?, ?, ?, ?, ?)", totals
+            )
+    finally:
+        conn.execute("DETACH DATABASE archive")
+
+    with conn:
+        # Deleting the orders fires the rollup triggers; keep the event's
+        # buckets as they were before the delete.
+        rollup = conn.execute(
+            "SELECT * FROM order_rollup WHERE event_id = ?", (event_id,)
+        ).fetchall()
+        conn.execute("DELETE FROM event_totals WHERE event_id = ?", (event_id,))
+        conn.executemany(
+            """
+            INSERT INTO event_totals (event_id, participant_id, name, orders, amount, yen)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            totals,
+        )
+        delete_event_rows(conn, event_id)
+        conn.executemany(
+            "INSERT OR REPLACE INTO order_rollup VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [tuple(row) for row in rollup],
+        )
+        conn.execute(
+            "UPDATE events SET closed_at = CURRENT_TIMESTAMP WHERE id = ?", (event_id,)
+        )
+    # The deletes above were logged row by row; trim the change log too.
+    prune_changes(conn)
+    # Hand the freed pages back to the file system. executescript steps the
+    # pragma to completion (execute would free a single page), and the
+    # checkpoint lets the file shrink without waiting for readers.
+    conn.executescript("PRAGMA incremental_vacuum; PRAGMA wal_checkpoint(PASSIVE);")
+    return True, None
@@ -0,0 +1,227 @@
+"""Settle drink_orders.db files from the command line.
+
+    python -m alcal totals drink_orders.db --event 2
+    python -m alcal batch nights/*.db --jobs 8 --output-dir settlements/
+    python -m alcal export drink_orders.db --event 2 --format parquet -o ledger.parquet
+    python -m alcal transfers drink_orders.db --event 2 --output transfers.csv
+    python -m alcal close drink_orders.db --event 2
+"""
+
+from __future__ import annotations
+
+import argparse
+import errno
+import os
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from alcal.archive import archive_path_for, close_event
+from alcal.export import write_ledger_csv, write_ledger_parquet
+from alcal.storage import (
+    DEFAULT_EVENT_ID,
+    SCHEMA_VERSION,
+    enable_incremental_vacuum,
+    fetch_event_totals,
+    fetch_events,
+    fetch_transfers,
+    init_db,
+    open_connection,
+)
+
+TOTALS_COLUMNS = ["イベントID", "イベント", "参加者", "支払い額"]
+TRANSFER_COLUMNS = {"from": "送る人", "to": "受け取る人", "amount": "金額"}
+
+
+def _require_file(path: str) -> None:
+    # sqlite3.connect would silently create a new, empty database.
+    if not os.path.isfile(path):
+        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+
+
+def open_input(path: str) -> sqlite3.Connection:
+    """Open an existing database for reading without changing it.
+
+    A database with an older schema is migrated in an in-memory copy, so
+    settling a file never rewrites, migrates or switches its journal mode.
+    """
+    _require_file(path)
+    conn = sqlite3.connect(f"{Path(path).resolve().as_uri()}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        # One read transaction for the whole command: a database the app is
+        # writing to is still read as a single consistent snapshot.
+        conn.execute("BEGIN")
+        return conn
+    copy = sqlite3.connect(":memory:")
+    copy.row_factory = sqlite3.Row
+    try:
+        conn.backup(copy)
+    finally:
+        conn.close()
+    init_db(copy)
+    return copy
+
+
+def settle_database(path: str, event_id: int | None = None) -> pd.DataFrame:
+    """Return the whole-yen totals of every event (or one event) in ``path``."""
+    conn = open_input(path)
+    try:
+        frames = []
+        for event in fetch_events(conn):
+            if event_id is not None and event["id"] != event_id:
+                continue
+            totals = fetch_event_totals(conn, event["id"])
+            frames.append(
+                pd.DataFrame(
+                    {
+                        "イベントID": event["id"],
+                        "イベント": event["name"],
+                        "参加者": totals["name"],
+                        "支払い額": totals["yen"],
+                    }
+                )
+            )
+    finally:
+        conn.close()
+    if not frames:
+        return pd.DataFrame(columns=TOTALS_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def _settle_to_file(path: str, output_dir: str) -> tuple[str, int, int]:
+    totals = settle_database(path)
+    output = Path(output_dir) / f"{Path(path).stem}_totals.csv"
+    totals.to_csv(output, index=False, encoding="utf-8-sig")
+    return str(output), totals["イベントID"].nunique(), int(totals["支払い額"].sum())
+
+
+def run_totals(args: argparse.Namespace) -> int:
+    totals = settle_database(args.database, args.event)
+    if args.output:
+        totals.to_csv(args.output, index=False, encoding="utf-8-sig")
+    elif totals.empty:
+        print("注文がありません。")
+    else:
+        print(totals.to_string(index=False))
+    return 0
+
+
+def run_batch(args: argparse.Namespace) -> int:
+    Path(args.output_dir).mkdir(parents=True, exist_ok=True)
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = {
+            path: pool.submit(_settle_to_file, path, args.output_dir)
+            for path in args.databases
+        }
+        for path, future in futures.items():
+            try:
+                output, events, grand_total = future.result()
+            except Exception as exc:
+                # One bad file (malformed database, pandas error, crashed
+                # worker) counts as one failure instead of ending the run.
+                failed += 1
+                print(f"{path}: 失敗しました ({exc})", file=sys.stderr)
+                continue
+            print(f"{path}: {events}イベント, 合計 {grand_total:,}円 -> {output}")
+    return 1 if failed else 0
+
+
+def run_export(args: argparse.Namespace) -> int:
+    conn = open_input(args.database)
+    try:
+        if args.format == "parquet":
+            rows = write_ledger_parquet(conn, args.event, args.output)
+            print(f"{rows:,}行を書き出しました -> {args.output}")
+        else:
+            with open(args.output, "wb") as sink:
+                written = write_ledger_csv(conn, args.event, sink)
+            print(f"{written:,}バイトを書き出しました -> {args.output}")
+    finally:
+        conn.close()
+    return 0
+
+
+def run_transfers(args: argparse.Namespace) -> int:
+    conn = open_input(args.database)
+    try:
+        transfers = pd.DataFrame(
+            fetch_transfers(conn, args.event), columns=list(TRANSFER_COLUMNS)
+        ).rename(columns=TRANSFER_COLUMNS)
+    finally:
+        conn.close()
+    if args.output:
+        transfers.to_csv(args.output, index=False, encoding="utf-8-sig")
+    elif transfers.empty:
+        print("送金は必要ありません。")
+    else:
+        print(transfers.to_string(index=False))
+    return 0
+
+
+def run_close(args: argparse.Namespace) -> int:
+    archive = args.archive or archive_path_for(args.database)
+    _require_file(args.database)
+    conn = open_connection(args.database)
+    try:
+        init_db(conn)
+        enable_incremental_vacuum(conn)
+        ok, err = close_event(conn, args.event, archive)
+    finally:
+        conn.close()
+    if not ok:
+        print(err, file=sys.stderr)
+        return 1
+    print(f"イベント{args.event}を終了しました -> {archive}")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="alcal", description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    totals = commands.add_parser("totals", help="1つのデータベースの支払い額を表示")
+    totals.add_argument("database")
+    totals.add_argument("--event", type=int, help="イベントIDで絞り込み")
+    totals.add_argument("--output", help="表示せずにCSVへ書き出す")
+    totals.set_defaults(func=run_totals)
+
+    batch = commands.add_parser("batch", help="複数のデータベースを並列で精算")
+    batch.add_argument("databases", nargs="+")
+    batch.add_argument("--jobs", type=int, default=None, help="プロセス数 (既定: CPU数)")
+    batch.add_argument("--output-dir", default=".", help="CSVの出力先")
+    batch.set_defaults(func=run_batch)
+
+    export = commands.add_parser("export", help="全注文の明細をCSV/Parquetで書き出す")
+    export.add_argument("database")
+    export.add_argument("--event", type=int, default=DEFAULT_EVENT_ID)
+    export.add_argument("--format", choices=("csv", "parquet"), default="csv")
+    export.add_argument("-o", "--output", required=True)
+    export.set_defaults(func=run_export)
+
+    transfers = commands.add_parser("transfers", help="誰が誰にいくら送金するかを表示")
+    transfers.add_argument("database")
+    transfers.add_argument("--event", type=int, default=DEFAULT_EVENT_ID)
+    transfers.add_argument("--output", help="表示せずにCSVへ書き出す")
+    transfers.set_defaults(func=run_transfers)
+
+    close = commands.add_parser("close", help="イベントを終了してアーカイブへ移す")
+    close.add_argument("database")
+    close.add_argument("--event", type=int, required=True)
+    close.add_argument("--archive", help="アーカイブ先 (既定: <database>_archive.db)")
+    close.set_defaults(func=run_close)
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except (sqlite3.Error, OSError, RuntimeError) as exc:
+        # RuntimeError: e.g. Parquet export without pyarrow.
+        print(f"失敗しました ({exc})", file=sys.stderr)
+        return 1
@@ -0,0 +1,292 @@
+"""Compact columnar representation of an event's orders."""
+
+from __future__ import annotations
+
+import sqlite3
+from collections.abc import Iterable
+from dataclasses import dataclass
+
+import numpy as np
+
+from alcal.settlement import net_balances, settle_transfers
+
+
+@dataclass(frozen=True)
+class OrderTable:
+    """Orders as parallel arrays plus a CSR share matrix.
+
+    The sharers of order ``i`` are
+    ``share_participants[share_offsets[i]:share_offsets[i + 1]]``; drink
+    names and categories are dictionary-encoded, and participant names are
+    resolved through the single ``participant_names`` table. ``payer_ids``
+    is 0 for orders whose payer is not recorded.
+    """
+
+    order_ids: np.ndarray
+    created_at: tuple[str, ...]
+    unit_prices: np.ndarray
+    quantities: np.ndarray
+    drink_codes: np.ndarray
+    drink_names: tuple[str, ...]
+    category_codes: np.ndarray
+    categories: tuple[str, ...]
+    memos: tuple[str, ...]
+    input_modes: tuple[str, ...]
+    payer_ids: np.ndarray
+    share_offsets: np.ndarray
+    share_participants: np.ndarray
+    participant_names: dict[int, str]
+
+    def __len__(self) -> int:
+        return len(self.order_ids)
+
+    @property
+    def share_counts(self) -> np.ndarray:
+        return np.diff(self.share_offsets)
+
+    @property
+    def total_prices(self) -> np.ndarray:
+        return self.unit_prices * self.quantities
+
+    def sharers(self, index: int) -> np.ndarray:
+        return self.share_participants[
+            self.share_offsets[index] : self.share_offsets[index + 1]
+        ]
+
+    @property
+    def active_categories(self) -> list[str]:
+        """Categories used by at least one order, in sorted order."""
+        return sorted(self.categories[code] for code in np.unique(self.category_codes))
+
+    def take(self, rows: np.ndarray) -> OrderTable:
+        """Return the table restricted to (and reordered by) ``rows``."""
+        counts = self.share_counts[rows]
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        share_index = np.repeat(self.share_offsets[:-1][rows] - offsets[:-1], counts)
+        share_index += np.arange(offsets[-1], dtype=np.int64)
+        return OrderTable(
+            order_ids=self.order_ids[rows],
+            created_at=tuple(self.created_at[row] for row in rows.tolist()),
+            unit_prices=self.unit_prices[rows],
+            quantities=self.quantities[rows],
+            drink_codes=self.drink_codes[rows],
+            drink_names=self.drink_names,
+            category_codes=self.category_codes[rows],
+            categories=self.categories,
+            memos=tuple(self.memos[row] for row in rows.tolist()),
+            input_modes=tuple(self.input_modes[row] for row in rows.tolist()),
+            payer_ids=self.payer_ids[rows],
+            share_offsets=offsets,
+            share_participants=self.share_participants[share_index],
+            participant_names=self.participant_names,
+        )
+
+    def apply_changes(self, updated: OrderTable, removed_ids: Iterable[int]) -> OrderTable:
+        """Replace or add the orders in ``updated`` and drop ``removed_ids``.
+
+        ``updated`` must carry the event's current participant names; rows
+        are kept in ``created_at, id`` order.
+        """
+        dropped = np.isin(
+            self.order_ids,
+            np.concatenate(
+                [updated.order_ids, np.fromiter(removed_ids, dtype=np.int64)]
+            ),
+        )
+        kept = self.take(np.flatnonzero(~dropped))
+        drink_codes, drink_names = _merge_codes(
+            kept.drink_names, updated.drink_names, updated.drink_codes
+        )
+        category_codes, categories = _merge_codes(
+            kept.categories, updated.categories, updated.category_codes
+        )
+        share_offsets = np.concatenate(
+            [kept.share_offsets, updated.share_offsets[1:] + kept.share_offsets[-1]]
+        )
+        merged = OrderTable(
+            order_ids=np.concatenate([kept.order_ids, updated.order_ids]),
+            created_at=kept.created_at + updated.created_at,
+            unit_prices=np.concatenate([kept.unit_prices, updated.unit_prices]),
+            quantities=np.concatenate([kept.quantities, updated.quantities]),
+            drink_codes=np.concatenate([kept.drink_codes, drink_codes]),
+            drink_names=drink_names,
+            category_codes=np.concatenate([kept.category_codes, category_codes]),
+            categories=categories,
+            memos=kept.memos + updated.memos,
+            input_modes=kept.input_modes + updated.input_modes,
+            payer_ids=np.concatenate([kept.payer_ids, updated.payer_ids]),
+            share_offsets=share_offsets,
+            share_participants=np.concatenate(
+                [kept.share_participants, updated.share_participants]
+            ),
+            participant_names=updated.participant_names,
+        )
+        order = np.lexsort((merged.order_ids, np.array(merged.created_at, dtype=str)))
+        if np.array_equal(order, np.arange(len(order))):
+            return merged
+        return merged.take(order)
+
+    def payments(self) -> tuple[dict[int, float], dict[int, float]]:
+        """Amount paid and amount owed per participant, over paid orders only.
+
+        Orders without a recorded payer (or without sharers) are left out, so
+        both sides add up to the same total.
+        """
+        counts = self.share_counts
+        paid_rows = (self.payer_ids > 0) & (counts > 0)
+        prices = np.where(paid_rows, self.total_prices, 0.0)
+        payer_ids, payer_index = np.unique(self.payer_ids[paid_rows], return_inverse=True)
+        paid = np.bincount(payer_index, weights=prices[paid_rows], minlength=len(payer_ids))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            per_share = np.repeat(prices / counts, counts)
+        sharer_ids, sharer_index = np.unique(self.share_participants, return_inverse=True)
+        owed = np.bincount(sharer_index, weights=per_share, minlength=len(sharer_ids))
+        return (
+            dict(zip(payer_ids.tolist(), paid.tolist())),
+            dict(zip(sharer_ids.tolist(), owed.tolist())),
+        )
+
+    def transfers(self) -> list[dict]:
+        """Whole-yen transfers from sharers to payers that settle the paid orders."""
+        names = self.participant_names
+        return [
+            {
+                "from_id": debtor,
+                "from": names[debtor],
+                "to_id": creditor,
+                "to": names[creditor],
+                "amount": amount,
+            }
+            for debtor, creditor, amount in settle_transfers(net_balances(*self.payments()))
+        ]
+
+    def to_dicts(self) -> list[dict]:
+        """Expand into the row-per-order dicts returned by ``fetch_orders``."""
+        orders = []
+        for index in range(len(self)):
+            sharer_ids = self.sharers(index).tolist()
+            payer_id = int(self.payer_ids[index]) or None
+            orders.append(
+                {
+                    "id": int(self.order_ids[index]),
+                    "created_at": self.created_at[index],
+                    "drink_name": self.drink_names[self.drink_codes[index]],
+                    "unit_price": float(self.unit_prices[index]),
+                    "quantity": int(self.quantities[index]),
+                    "memo": self.memos[index],
+                    "category": self.categories[self.category_codes[index]],
+                    "input_mode": self.input_modes[index],
+                    "payer_id": payer_id,
+                    "share_with": [self.participant_names[pid] for pid in sharer_ids],
+                    "share_with_ids": sharer_ids,
+                }
+            )
+        return orders
+
+
+def _encode(values: list[str]) -> tuple[np.ndarray, tuple[str, ...]]:
+    codes: dict[str, int] = {}
+    encoded = np.fromiter(
+        (codes.setdefault(value, len(codes)) for value in values),
+        dtype=np.int32,
+        count=len(values),
+    )
+    return encoded, tuple(codes)
+
+
+def _merge_codes(
+    names: tuple[str, ...], other_names: tuple[str, ...], other_codes: np.ndarray
+) -> tuple[np.ndarray, tuple[str, ...]]:
+    """Re-encode ``other_codes`` against ``names``, extending it as needed."""
+    index = dict(zip(names, range(len(names))))
+    for name in other_names:
+        index.setdefault(name, len(index))
+    mapping = np.array([index[name] for name in other_names], dtype=np.int32)
+    return mapping[other_codes] if len(mapping) else other_codes, tuple(index)
+
+
+def fetch_order_table(
+    conn: sqlite3.Connection, event_id: int, order_ids: list[int] | None = None
+) -> OrderTable:
+    """Load an event's orders in ``created_at, id`` order as an OrderTable.
+
+    With ``order_ids`` only those orders are read, e.g. to apply a delta
+    from the change log.
+    """
+    where = "event_id = ?"
+    params: list = [event_id]
+    if order_ids is not None:
+        where += f" AND {{column}} IN ({', '.join('?' for _ in order_ids)})"
+        params.extend(order_ids)
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    order_rows = cursor.execute(
+        f"""
+        SELECT id, created_at, drink_name, unit_price, quantity, category, memo,
+               input_mode, payer_id
+        FROM orders
+        WHERE {where.format(column="id")}
+        ORDER BY created_at, id
+        """,
+        params,
+    ).fetchall()
+    share_rows = cursor.execute(
+        "SELECT order_id, participant_id FROM order_shares"
+        f" WHERE {where.format(column='order_id')}",
+        params,
+    ).fetchall()
+    participant_names = dict(
+        cursor.execute(
+            "SELECT id, name FROM participants WHERE event_id = ?", (event_id,)
+        ).fetchall()
+    )
+
+    order_ids = np.array([row[0] for row in order_rows], dtype=np.int64)
+    drink_codes, drink_names = _encode([row[2] for row in order_rows])
+    category_codes, categories = _encode([row[5] or "" for row in order_rows])
+
+    # Lay the shares out in table row order, sharers sorted by name as in
+    # fetch_orders; sorting here avoids a join and sort in SQL.
+    share_order_ids = np.array([row[0] for row in share_rows], dtype=np.int64)
+    share_participants = np.array([row[1] for row in share_rows], dtype=np.int64)
+    row_of_order = np.argsort(order_ids, kind="stable")
+    positions = row_of_order[np.searchsorted(order_ids[row_of_order], share_order_ids)]
+    by_name = sorted(participant_names, key=lambda pid: participant_names[pid].lower())
+    name_rank = dict(zip(by_name, range(len(by_name))))
+    ranks = np.array([name_rank[pid] for pid in share_participants.tolist()], dtype=np.int64)
+    layout = np.lexsort((ranks, positions))
+    counts = np.bincount(positions, minlength=len(order_ids))
+    share_offsets = np.zeros(len(order_ids) + 1, dtype=np.int64)
+    np.cumsum(counts, out=share_offsets[1:])
+
+    return OrderTable(
+        order_ids=order_ids,
+        created_at=tuple(row[1] for row in order_rows),
+        unit_prices=np.array([row[3] for row in order_rows], dtype=np.float64),
+        quantities=np.array([row[4] for row in order_rows], dtype=np.int32),
+        drink_codes=drink_codes,
+        drink_names=drink_names,
+        category_codes=category_codes,
+        categories=categories,
+        memos=tuple(row[6] or "" for row in order_rows),
+        input_modes=tuple(row[7] or "" for row in order_rows),
+        payer_ids=np.array([row[8] or 0 for row in order_rows], dtype=np.int64),
+        share_offsets=share_offsets,
+        share_participants=share_participants[layout],
+        participant_names=participant_names,
+    )
+
+
+def refresh_order_table(
+    conn: sqlite3.Connection, event_id: int, orders: OrderTable, order_ids: Iterable[int]
+) -> OrderTable:
+    """Bring ``orders`` up to date after the orders ``order_ids`` changed.
+
+    Every touched order is re-read; the ones that no longer exist were
+    removed. Going by the log's delete entries instead would drop an order
+    that was voided and then restored by an undo under the same id.
+    """
+    touched = sorted(set(order_ids))
+    updated = fetch_order_table(conn, event_id, touched)
+    return orders.apply_changes(updated, set(touched) - set(updated.order_ids.tolist()))
@@ -0,0 +1,147 @@
+"""Streaming export of the full ledger: one row per order and sharer."""
+
+from __future__ import annotations
+
+import csv
+import importlib.util
+import io
+import sqlite3
+from collections.abc import Iterator
+from typing import BinaryIO
+
+# Parquet export is optional; pyarrow is only imported when it is used.
+PARQUET_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+
+EXPORT_CHUNK_ROWS = 5000
+LEDGER_COLUMNS = [
+    "order_id",
+    "created_at",
+    "category",
+    "drink_name",
+    "unit_price",
+    "quantity",
+    "total_price",
+    "sharers",
+    "participant_id",
+    "participant",
+    "amount",
+    "payer_id",
+    "payer",
+]
+
+
+def iter_ledger_chunks(
+    conn: sqlite3.Connection, event_id: int, chunk_rows: int = EXPORT_CHUNK_ROWS
+) -> Iterator[list[tuple]]:
+    """Yield the event's ledger rows in chunks straight from the cursor.
+
+    ``amount`` is the participant's exact share of the order; only one chunk
+    is held in memory at a time.
+    """
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(
+        """
+        SELECT
+            o.id,
+            o.created_at,
+            o.category,
+            o.drink_name,
+            o.unit_price,
+            o.quantity,
+            o.unit_price * o.quantity,
+            c.sharers,
+            p.id,
+            p.name,
+            o.unit_price * o.quantity / c.sharers,
+            o.payer_id,
+            payer.name
+        FROM orders o
+        JOIN (
+            SELECT order_id, COUNT(*) AS sharers
+            FROM order_shares
+            WHERE event_id = ?
+            GROUP BY order_id
+        ) c ON c.order_id = o.id
+        JOIN order_shares os ON os.order_id = o.id
+        JOIN participants p ON p.id = os.participant_id
+        LEFT JOIN participants payer ON payer.id = o.payer_id
+        WHERE o.event_id = ?
+        ORDER BY o.created_at, o.id, os.participant_id
+        """,
+        (event_id, event_id),
+    )
+    try:
+        while chunk := cursor.fetchmany(chunk_rows):
+            yield chunk
+    finally:
+        cursor.close()
+
+
+def iter_ledger_csv(
+    conn: sqlite3.Connection, event_id: int, chunk_rows: int = EXPORT_CHUNK_ROWS
+) -> Iterator[bytes]:
+    """Yield the ledger as UTF-8 (with BOM, for Excel) CSV, one chunk at a time."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(LEDGER_COLUMNS)
+    prefix = "\ufeff"
+    for chunk in iter_ledger_chunks(conn, event_id, chunk_rows):
+        writer.writerows(chunk)
+        yield (prefix + buffer.getvalue()).encode("utf-8")
+        prefix = ""
+        buffer.seek(0)
+        buffer.truncate()
+    if prefix:
+        yield (prefix + buffer.getvalue()).encode("utf-8")
+
+
+def write_ledger_csv(conn: sqlite3.Connection, event_id: int, sink: BinaryIO) -> int:
+    """Stream the ledger CSV into ``sink``; returns the number of bytes written."""
+    written = 0
+    for data in iter_ledger_csv(conn, event_id):
+        written += sink.write(data)
+    return written
+
+
+def write_ledger_parquet(
+    conn: sqlite3.Connection, event_id: int, sink: BinaryIO | str
+) -> int:
+    """Stream the ledger into a Parquet file, one row group per chunk.
+
+    Returns the number of rows written. Requires pyarrow.
+    """
+    if not PARQUET_AVAILABLE:
+        raise RuntimeError("Parquetの書き出しには pyarrow が必要です。")
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema(
+        [
+            ("order_id", pa.int64()),
+            ("created_at", pa.string()),
+            ("category", pa.string()),
+            ("drink_name", pa.string()),
+            ("unit_price", pa.float64()),
+            ("quantity", pa.int64()),
+            ("total_price", pa.float64()),
+            ("sharers", pa.int64()),
+            ("participant_id", pa.int64()),
+            ("participant", pa.string()),
+            ("amount", pa.float64()),
+            ("payer_id", pa.int64()),
+            ("payer", pa.string()),
+        ]
+    )
+    rows = 0
+    with pq.ParquetWriter(sink, schema, compression="zstd") as writer:
+        for chunk in iter_ledger_chunks(conn, event_id):
+            arrays = [
+                pa.array(column, type=field.type)
+                for column, field in zip(zip(*chunk), schema)
+            ]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            rows += len(chunk)
+        if not rows:
+            writer.write_table(schema.empty_table())
+    return rows
@@ -0,0 +1,140 @@
+"""Shop menus: file parsing, price lookup and normalized search."""
+
+from __future__ import annotations
+
+import csv
+import json
+import unicodedata
+from functools import cached_property
+from pathlib import Path
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    tomllib = None
+
+# Katakana (ァ..ヶ) sits exactly 0x60 code points above its hiragana counterpart.
+_KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(ord("ァ"), ord("ヶ") + 1)}
+
+
+def normalize_text(text: str) -> str:
+    """Fold width, case and kana so that ﾊｲﾎﾞｰﾙ, ハイボール and はいぼーる match."""
+    folded = unicodedata.normalize("NFKC", text).casefold()
+    return "".join(folded.split()).translate(_KATAKANA_TO_HIRAGANA)
+
+
+class MenuSearchIndex:
+    """Bigram index over menu items with ranked substring search."""
+
+    def __init__(self, items: list[dict]) -> None:
+        self.items = [
+            {
+                "カテゴリー": item["カテゴリー"],
+                "ドリンク": item["ドリンク"],
+                "価格(円)": (
+                    f"{int(item['価格']):,}"
+                    if isinstance(item["価格"], (int, float))
+                    else "未設定"
+                ),
+            }
+            for item in items
+        ]
+        self._names = [normalize_text(item["ドリンク"]) for item in items]
+        self._categories = [normalize_text(item["カテゴリー"]) for item in items]
+        self._postings: dict[str, set[int]] = {}
+        for idx, (name, category) in enumerate(zip(self._names, self._categories)):
+            for text in (name, category):
+                for gram in set(text) | self._bigrams(text):
+                    self._postings.setdefault(gram, set()).add(idx)
+
+    @staticmethod
+    def _bigrams(text: str) -> set[str]:
+        return {text[i : i + 2] for i in range(len(text) - 1)}
+
+    def _rank(self, idx: int, query: str) -> tuple | None:
+        name = self._names[idx]
+        if name == query:
+            match = 0
+        elif name.startswith(query):
+            match = 1
+        elif query in name:
+            match = 2
+        elif query in self._categories[idx]:
+            match = 3
+        else:
+            return None
+        return match, len(name), idx
+
+    def search(self, query: str) -> list[dict]:
+        """Return the items matching ``query``, best matches first."""
+        query = normalize_text(query)
+        if not query:
+            return self.items
+        grams = self._bigrams(query) or {query}
+        candidates = set.intersection(
+            *(self._postings.get(gram, set()) for gram in grams)
+        )
+        ranked = sorted(
+            key
+            for key in (self._rank(idx, query) for idx in candidates)
+            if key is not None
+        )
+        return [self.items[idx] for _, _, idx in ranked]
+
+
+MENU_SUFFIXES = (".json", ".toml", ".csv")
+
+MenuData = dict[str, list[tuple[str, float | None]]]
+
+
+class Menu:
+    """One shop's menu with a prebuilt drink name -> (category, price) index."""
+
+    def __init__(self, categories: MenuData) -> None:
+        self.categories = categories
+        self.items = [
+            {"カテゴリー": category, "ドリンク": name, "価格": price}
+            for category, entries in categories.items()
+            for name, price in entries
+        ]
+        self.prices: dict[str, tuple[str, float | None]] = {}
+        for item in self.items:
+            self.prices.setdefault(item["ドリンク"], (item["カテゴリー"], item["価格"]))
+
+    @cached_property
+    def search_index(self) -> MenuSearchIndex:
+        return MenuSearchIndex(self.items)
+
+
+def _parse_price(value: str | float | None) -> float | None:
+    if value is None or value == "":
+        return None
+    return float(value) if float(value) % 1 else int(float(value))
+
+
+def parse_menu_file(path: Path) -> MenuData:
+    """Read a menu file into ``{category: [(name, price), ...]}``.
+
+    JSON and TOML files map each category to a list of ``[name, price]``
+    pairs; CSV files have ``category,name,price`` columns.
+    """
+    categories: MenuData = {}
+    if path.suffix == ".csv":
+        with path.open(encoding="utf-8-sig", newline="") as f:
+            for row in csv.DictReader(f):
+                categories.setdefault(row["category"], []).append(
+                    (row["name"], _parse_price(row.get("price")))
+                )
+        return categories
+
+    if path.suffix == ".toml":
+        if tomllib is None:
+            raise ValueError("TOMLのメニューにはPython 3.11以上が必要です。")
+        with path.open("rb") as f:
+            raw = tomllib.load(f)
+    else:
+        with path.open(encoding="utf-8") as f:
+            raw = json.load(f)
+    for category, entries in raw.items():
+        categories[category] = [(name, _parse_price(price)) for name, price in entries]
+    return categories
@@ -0,0 +1,123 @@
+"""Opt-in timing of rerun phases and SQL statements."""
+
+from __future__ import annotations
+
+import json
+import sqlite3
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+# Number of SQLite VM instructions between two progress handler calls.
+PROGRESS_STEPS = 1000
+
+_active_profiler: ContextVar[RerunProfiler | None] = ContextVar(
+    "alcal_profiler", default=None
+)
+
+
+def active_profiler() -> RerunProfiler | None:
+    return _active_profiler.get()
+
+
+@contextmanager
+def profile_phase(name: str) -> Iterator[None]:
+    """Time a block against the active profiler; a no-op when profiling is off."""
+    profiler = _active_profiler.get()
+    if profiler is None:
+        yield
+        return
+    with profiler.phase(name):
+        yield
+
+
+class RerunProfiler:
+    """Collects phase timings and traced SQL statements for one rerun.
+
+    Statements are captured with ``set_trace_callback``; a statement's
+    duration is measured until the next statement starts or the connection
+    is released, so it includes fetching its rows. ``set_progress_handler``
+    counts the SQLite VM instructions each statement executed.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.finished: float | None = None
+        self.phases: dict[str, float] = {}
+        self.statements: list[dict] = []
+
+    @contextmanager
+    def activate(self) -> Iterator[RerunProfiler]:
+        """Profile the block, however it is left.
+
+        Streamlit reruns raise out of the script and the next run reuses the
+        same thread, so the profiler must not outlive the block that set it.
+        """
+        token = _active_profiler.set(self)
+        try:
+            yield self
+        finally:
+            self.finished = time.perf_counter()
+            _active_profiler.reset(token)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    @contextmanager
+    def trace(self, conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+        current: list[dict] = []
+
+        def finish(now: float) -> None:
+            if current:
+                statement = current.pop()
+                statement["duration_ms"] = (now - statement.pop("_started")) * 1000
+                self.statements.append(statement)
+
+        def on_statement(sql: str) -> None:
+            now = time.perf_counter()
+            finish(now)
+            current.append(
+                {
+                    "sql": " ".join(sql.split()),
+                    "offset_ms": (now - self.started) * 1000,
+                    "vm_steps": 0,
+                    "_started": now,
+                }
+            )
+
+        def on_progress() -> int:
+            if current:
+                current[-1]["vm_steps"] += PROGRESS_STEPS
+            return 0
+
+        conn.set_trace_callback(on_statement)
+        conn.set_progress_handler(on_progress, PROGRESS_STEPS)
+        try:
+            yield conn
+        finally:
+            finish(time.perf_counter())
+            conn.set_trace_callback(None)
+            conn.set_progress_handler(None, 0)
+
+    def summary(self) -> dict:
+        finished = self.finished or time.perf_counter()
+        return {
+            "total_ms": (finished - self.started) * 1000,
+            "phases_ms": {name: seconds * 1000 for name, seconds in self.phases.items()},
+            "sql_count": len(self.statements),
+            "sql_ms": sum(statement["duration_ms"] for statement in self.statements),
+            "statements": self.statements,
+        }
+
+    def write_jsonl(self, path: str | Path, **extra: object) -> None:
+        record = {"timestamp": time.time(), **extra, **self.summary()}
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
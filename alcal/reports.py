@@ -0,0 +1,188 @@
+"""Aggregated reports over events, backed by trigger-maintained rollups."""
+
+from __future__ import annotations
+
+import sqlite3
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Orders are bucketed by the hour (server local time) they were recorded in.
+HOUR_BUCKET = "strftime('%Y-%m-%d %H:00', {row}.created_at, 'localtime')"
+ROLLUP_KEY = ("event_id", "hour", "category", "drink_name")
+
+
+def _rollup_upsert(row: str, sign: int) -> str:
+    return f"""
+        INSERT INTO order_rollup (event_id, hour, category, drink_name, orders, cups, amount)
+        VALUES (
+            {row}.event_id,
+            {HOUR_BUCKET.format(row=row)},
+            COALESCE({row}.category, ''),
+            {row}.drink_name,
+            {sign},
+            {sign} * {row}.quantity,
+            {sign} * {row}.unit_price * {row}.quantity
+        )
+        ON CONFLICT ({", ".join(ROLLUP_KEY)}) DO UPDATE SET
+            orders = orders + excluded.orders,
+            cups = cups + excluded.cups,
+            amount = amount + excluded.amount;
+    """
+
+
+def _rollup_cleanup(row: str) -> str:
+    # Drop buckets emptied by deletes so the table only holds live data.
+    return f"""
+        DELETE FROM order_rollup
+        WHERE event_id = {row}.event_id
+          AND hour = {HOUR_BUCKET.format(row=row)}
+          AND category = COALESCE({row}.category, '')
+          AND drink_name = {row}.drink_name
+          AND orders = 0;
+    """
+
+
+def init_rollups(conn: sqlite3.Connection) -> None:
+    """Create the hourly rollup table and the triggers on ``orders`` feeding it."""
+    has_rollup = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'order_rollup'"
+    ).fetchone()
+    conn.executescript(
+        f"""
+        CREATE TABLE IF NOT EXISTS order_rollup (
+            event_id INTEGER NOT NULL,
+            hour TEXT NOT NULL,
+            category TEXT NOT NULL,
+            drink_name TEXT NOT NULL,
+            orders INTEGER NOT NULL,
+            cups INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            PRIMARY KEY ({", ".join(ROLLUP_KEY)})
+        );
+
+        CREATE TRIGGER IF NOT EXISTS trg_orders_insert_rollup
+        AFTER INSERT ON orders
+        BEGIN
+            {_rollup_upsert("NEW", 1)}
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_orders_delete_rollup
+        AFTER DELETE ON orders
+        BEGIN
+            {_rollup_upsert("OLD", -1)}
+            {_rollup_cleanup("OLD")}
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_orders_update_rollup
+        AFTER UPDATE OF event_id, drink_name, unit_price, quantity, category, created_at
+        ON orders
+        BEGIN
+            {_rollup_upsert("OLD", -1)}
+            {_rollup_upsert("NEW", 1)}
+            {_rollup_cleanup("OLD")}
+        END;
+        """
+    )
+    if not has_rollup:
+        rebuild_rollups(conn)
+
+
+def rebuild_rollups(conn: sqlite3.Connection) -> None:
+    """Recompute the rollup table from the orders, e.g. for older databases.
+
+    Closed events have no orders left, so their buckets are kept as they are.
+    """
+    with conn:
+        conn.execute(
+            """
+            DELETE FROM order_rollup
+            WHERE event_id NOT IN (SELECT id FROM events WHERE closed_at IS NOT NULL)
+            """
+        )
+        conn.execute(
+            f"""
+            INSERT INTO order_rollup (event_id, hour, category, drink_name, orders, cups, amount)
+            SELECT
+                event_id,
+                {HOUR_BUCKET.format(row="orders")} AS hour,
+                COALESCE(category, '') AS category,
+                drink_name,
+                COUNT(*),
+                SUM(quantity),
+                SUM(unit_price * quantity)
+            FROM orders
+            GROUP BY event_id, hour, category, drink_name
+            """
+        )
+
+
+def _rollup_report(
+    conn: sqlite3.Connection, group_by: str, order_by: str, event_id: int | None
+) -> pd.DataFrame:
+    import pandas as pd
+
+    where = "WHERE event_id = ?" if event_id is not None else ""
+    params = (event_id,) if event_id is not None else ()
+    return pd.read_sql_query(
+        f"""
+        SELECT {group_by}, SUM(orders) AS orders, SUM(cups) AS cups, SUM(amount) AS amount
+        FROM order_rollup
+        {where}
+        GROUP BY {group_by}
+        ORDER BY {order_by}
+        """,
+        conn,
+        params=params,
+    )
+
+
+def drink_report(conn: sqlite3.Connection, event_id: int | None = None) -> pd.DataFrame:
+    """Popularity per drink, across all events unless ``event_id`` is given."""
+    return _rollup_report(conn, "drink_name, category", "cups DESC, drink_name", event_id)
+
+
+def category_report(conn: sqlite3.Connection, event_id: int | None = None) -> pd.DataFrame:
+    return _rollup_report(conn, "category", "amount DESC, category", event_id)
+
+
+def hourly_report(conn: sqlite3.Connection, event_id: int | None = None) -> pd.DataFrame:
+    return _rollup_report(conn, "hour", "hour", event_id)
+
+
+def person_report(conn: sqlite3.Connection, event_id: int | None = None) -> pd.DataFrame:
+    """Spend and number of shared orders per person, matched by name across events.
+
+    Amounts come from the ``participant_balances`` ledger, which is already
+    maintained incrementally, and from the final totals of closed events.
+    """
+    import pandas as pd
+
+    live_where = "WHERE p.event_id = ?" if event_id is not None else ""
+    closed_where = "WHERE event_id = ?" if event_id is not None else ""
+    params = (event_id, event_id) if event_id is not None else ()
+    return pd.read_sql_query(
+        f"""
+        SELECT name, COUNT(DISTINCT event_id) AS events, SUM(orders) AS orders,
+            SUM(amount) AS amount
+        FROM (
+            SELECT
+                p.name,
+                p.event_id,
+                (SELECT COUNT(*) FROM order_shares os WHERE os.participant_id = p.id)
+                    AS orders,
+                COALESCE(pb.amount, 0) AS amount
+            FROM participants p
+            LEFT JOIN participant_balances pb ON pb.participant_id = p.id
+            {live_where}
+            UNION ALL
+            SELECT name, event_id, orders, amount FROM event_totals
+            {closed_where}
+        )
+        GROUP BY name
+        ORDER BY amount DESC, name
+        """,
+        conn,
+        params=params,
+    )
@@ -0,0 +1,173 @@
+"""Splitting orders between their sharers in whole yen."""
+
+from __future__ import annotations
+
+import heapq
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+def allocate_yen(amounts: np.ndarray, total: int) -> np.ndarray:
+    """Round amounts to whole yen so that they sum exactly to ``total``.
+
+    Every amount is floored and the leftover yen go to the largest fractional
+    remainders (ties are broken by position).
+    """
+    amounts = np.asarray(amounts, dtype=np.float64)
+    floors = np.floor(amounts).astype(np.int64)
+    shortfall = int(np.clip(total - floors.sum(), 0, len(amounts)))
+    if shortfall:
+        order = np.argsort(floors - amounts, kind="stable")
+        floors[order[:shortfall]] += 1
+    return floors
+
+
+def compute_settlement(
+    share_rows: pd.DataFrame, participant_ids: list[int]
+) -> pd.DataFrame:
+    """Split every order between its sharers in one batched pass.
+
+    ``share_rows`` is the long-form table from :func:`fetch_share_rows`. The
+    result has one row per participant with the exact ``amount`` and the
+    integer ``yen`` to pay; the yen column sums to the rounded grand total.
+    """
+    import pandas as pd
+
+    sharers = share_rows.groupby("order_id")["order_id"].transform("size")
+    shares = share_rows["total_price"].to_numpy(dtype=np.float64) / sharers.to_numpy()
+    amounts = (
+        pd.Series(shares, index=share_rows["participant_id"].to_numpy())
+        .groupby(level=0)
+        .sum()
+        .reindex(participant_ids, fill_value=0.0)
+    )
+    grand_total = (
+        share_rows.drop_duplicates("order_id")["total_price"].sum()
+        if len(share_rows)
+        else 0.0
+    )
+    return pd.DataFrame(
+        {
+            "participant_id": participant_ids,
+            "amount": amounts.to_numpy(),
+            "yen": allocate_yen(amounts.to_numpy(), round(grand_total)),
+        }
+    )
+
+
+# Up to this many people with a non-zero balance the transfers are provably
+# minimal; the exact search is exponential in this number.
+EXACT_TRANSFER_LIMIT = 12
+
+
+def net_balances(paid: dict[int, float], owed: dict[int, float]) -> dict[int, int]:
+    """Whole-yen balance (paid minus owed) per participant, summing to zero.
+
+    Positive balances are owed money, negative ones have to pay. Both sides
+    are rounded with :func:`allocate_yen` against the same grand total.
+    """
+    participant_ids = sorted(paid.keys() | owed.keys())
+    paid_amounts = np.array([paid.get(pid, 0.0) for pid in participant_ids])
+    owed_amounts = np.array([owed.get(pid, 0.0) for pid in participant_ids])
+    total = round(paid_amounts.sum())
+    balances = allocate_yen(paid_amounts, total) - allocate_yen(owed_amounts, total)
+    return {pid: int(amount) for pid, amount in zip(participant_ids, balances.tolist())}
+
+
+def settle_transfers(balances: dict[int, int]) -> list[tuple[int, int, int]]:
+    """Return ``(from_id, to_id, yen)`` transfers that bring every balance to zero.
+
+    With at most ``EXACT_TRANSFER_LIMIT`` non-zero balances the number of
+    transfers is minimal. Larger groups are settled greedily, largest debt
+    against largest credit, after pairing equal debts and credits; that
+    needs at most one transfer less than the number of people involved.
+    """
+    open_balances = {pid: amount for pid, amount in balances.items() if amount}
+    if sum(open_balances.values()):
+        raise ValueError("balances must sum to zero")
+    if len(open_balances) <= EXACT_TRANSFER_LIMIT:
+        transfers: list[tuple[int, int, int]] = []
+        for group in _zero_sum_groups(open_balances):
+            transfers.extend(_greedy_transfers({pid: open_balances[pid] for pid in group}))
+        return transfers
+    transfers = _pair_equal_balances(open_balances)
+    return transfers + _greedy_transfers(open_balances)
+
+
+def _greedy_transfers(balances: dict[int, int]) -> list[tuple[int, int, int]]:
+    # Max-heaps by amount; every transfer settles at least one side.
+    creditors = [(-amount, pid) for pid, amount in balances.items() if amount > 0]
+    debtors = [(amount, pid) for pid, amount in balances.items() if amount < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+    transfers = []
+    while creditors and debtors:
+        credit, creditor = heapq.heappop(creditors)
+        debt, debtor = heapq.heappop(debtors)
+        amount = min(-credit, -debt)
+        transfers.append((debtor, creditor, amount))
+        if credit + amount:
+            heapq.heappush(creditors, (credit + amount, creditor))
+        if debt + amount:
+            heapq.heappush(debtors, (debt + amount, debtor))
+    return transfers
+
+
+def _pair_equal_balances(balances: dict[int, int]) -> list[tuple[int, int, int]]:
+    """Settle debtors whose debt equals some credit with one transfer each.
+
+    The matched people are removed from ``balances``.
+    """
+    creditors_by_amount: dict[int, list[int]] = {}
+    for pid, amount in balances.items():
+        if amount > 0:
+            creditors_by_amount.setdefault(amount, []).append(pid)
+    transfers = []
+    for pid, amount in list(balances.items()):
+        candidates = creditors_by_amount.get(-amount)
+        if amount < 0 and candidates:
+            creditor = candidates.pop()
+            transfers.append((pid, creditor, -amount))
+            del balances[pid], balances[creditor]
+    return transfers
+
+
+def _zero_sum_groups(balances: dict[int, int]) -> list[list[int]]:
+    """Split the participants into as many zero-sum groups as possible.
+
+    Settling a group of ``k`` people takes ``k - 1`` transfers, so the most
+    groups give the fewest transfers. Dynamic programming over subsets:
+    ``best[mask]`` is the most zero-sum groups a removal order of ``mask``
+    passes through.
+    """
+    participant_ids = list(balances)
+    count = len(participant_ids)
+    if not count:
+        return []
+    masks = np.arange(1 << count)
+    bits = (masks[:, None] >> np.arange(count)) & 1
+    zero_sum = (bits @ np.array([balances[pid] for pid in participant_ids])) == 0
+    zero_sum = zero_sum.tolist()
+    best = [0] * (1 << count)
+    for mask in range(1, 1 << count):
+        best[mask] = zero_sum[mask] + max(
+            best[mask & ~(1 << bit)] for bit in range(count) if mask >> bit & 1
+        )
+
+    groups = []
+    mask = group_start = (1 << count) - 1
+    while mask:
+        for bit in range(count):
+            rest = mask & ~(1 << bit)
+            if mask >> bit & 1 and best[rest] + zero_sum[mask] == best[mask]:
+                mask = rest
+                break
+        if zero_sum[mask]:
+            members = group_start & ~mask
+            groups.append([participant_ids[bit] for bit in range(count) if members >> bit & 1])
+            group_start = mask
+    return groups
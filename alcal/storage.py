@@ -0,0 +1,1254 @@
+"""SQLite storage for events, participants, orders and the balance ledger."""
+
+from __future__ import annotations
+
+import csv
+import io
+import json
+import math
+import queue
+import sqlite3
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager, nullcontext
+from typing import TYPE_CHECKING
+
+from alcal.columnar import fetch_order_table
+from alcal.menu import Menu
+from alcal.profiling import active_profiler
+from alcal.reports import init_rollups
+from alcal.settlement import compute_settlement
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+DEFAULT_EVENT_ID = 1
+DEFAULT_EVENT_NAME = "デフォルト"
+BUSY_TIMEOUT_SECONDS = 5.0
+READER_POOL_SIZE = 4
+ORDER_PAGE_SIZE = 20
+# Stored in PRAGMA user_version once init_db has brought a database up to
+# date; bump it whenever init_db learns a new table, index or trigger.
+SCHEMA_VERSION = 4
+# Change log rows kept for clients polling for deltas; older ones are pruned.
+CHANGE_LOG_RETENTION = 50_000
+# Database.writer prunes the change log after this many writes, so a
+# long-running process does not let it grow until the next restart.
+CHANGE_LOG_PRUNE_INTERVAL = 500
+# Tables whose inserts and deletes are recorded in the change log, with the
+# column logged as row_id (the order id for share rows).
+CHANGE_LOGGED_TABLES = {"participants": "id", "orders": "id", "order_shares": "order_id"}
+
+
+def open_connection(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_SECONDS, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
+
+class Database:
+    """SQLite access shared by every thread of a process.
+
+    Writes go through a single connection guarded by a lock, so sessions
+    queue up in-process instead of fighting over SQLite's write lock. Reads
+    borrow one of a small pool of connections and, thanks to WAL journaling,
+    never wait for a writer.
+    """
+
+    def __init__(self, path: str, pool_size: int = READER_POOL_SIZE) -> None:
+        self.path = path
+        self._writer = open_connection(path)
+        self._write_lock = threading.Lock()
+        self._writes = 0
+        self._probe = open_connection(path)
+        self._probe_lock = threading.Lock()
+        self._readers: queue.Queue[sqlite3.Connection] = queue.Queue()
+        for _ in range(pool_size):
+            self._readers.put(open_connection(path))
+
+    @staticmethod
+    def _traced(conn: sqlite3.Connection):
+        profiler = active_profiler()
+        return profiler.trace(conn) if profiler else nullcontext(conn)
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        with self._write_lock, self._traced(self._writer) as conn:
+            yield conn
+            self._writes += 1
+            if self._writes % CHANGE_LOG_PRUNE_INTERVAL == 0:
+                prune_changes(conn)
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a reader; every query in the block sees the same snapshot.
+
+        Without the explicit transaction each SELECT would autocommit, and a
+        write landing between two of them could pair share rows with orders
+        or participants the earlier query never saw.
+        """
+        conn = self._readers.get()
+        try:
+            conn.execute("BEGIN")
+            with self._traced(conn):
+                yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._readers.put(conn)
+
+    def data_version(self) -> int:
+        """Return a value that changes whenever any connection commits."""
+        with self._probe_lock:
+            return self._probe.execute("PRAGMA data_version").fetchone()[0]
+
+
+def init_db(conn: sqlite3.Connection) -> None:
+    """Create or upgrade the schema; only a version read once it is current."""
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        return
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+
+        CREATE TABLE IF NOT EXISTS participants (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id INTEGER NOT NULL DEFAULT 1,
+            name TEXT NOT NULL,
+            UNIQUE (event_id, name)
+        );
+
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id INTEGER NOT NULL DEFAULT 1,
+            drink_name TEXT NOT NULL,
+            unit_price REAL NOT NULL,
+            quantity INTEGER NOT NULL,
+            memo TEXT,
+            category TEXT,
+            input_mode TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+
+        CREATE TABLE IF NOT EXISTS order_shares (
+            order_id INTEGER NOT NULL,
+            participant_id INTEGER NOT NULL,
+            event_id INTEGER NOT NULL DEFAULT 1,
+            PRIMARY KEY (order_id, participant_id),
+            FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE CASCADE,
+            FOREIGN KEY (participant_id) REFERENCES participants(id) ON DELETE CASCADE
+        );
+        """
+    )
+    migrate_to_events(conn)
+    migrate_order_payers(conn)
+    conn.executescript(
+        """
+        CREATE INDEX IF NOT EXISTS idx_orders_event
+            ON orders (event_id, created_at, id);
+        CREATE INDEX IF NOT EXISTS idx_order_shares_event
+            ON order_shares (event_id, order_id);
+        CREATE INDEX IF NOT EXISTS idx_order_shares_participant
+            ON order_shares (participant_id);
+        """
+    )
+    conn.execute(
+        "INSERT OR IGNORE INTO events (id, name) VALUES (?, ?)",
+        (DEFAULT_EVENT_ID, DEFAULT_EVENT_NAME),
+    )
+    has_ledger = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'participant_balances'"
+    ).fetchone()
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS participant_balances (
+            participant_id INTEGER PRIMARY KEY,
+            amount REAL NOT NULL DEFAULT 0,
+            FOREIGN KEY (participant_id) REFERENCES participants(id) ON DELETE CASCADE
+        )
+        """
+    )
+    conn.commit()
+    if not has_ledger and conn.execute("SELECT 1 FROM orders LIMIT 1").fetchone():
+        # Databases created before the ledger existed need a one-off backfill.
+        rebuild_balances(conn)
+    init_event_archive(conn)
+    init_change_log(conn)
+    init_rollups(conn)
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS order_log (
+            seq INTEGER PRIMARY KEY,
+            event_id INTEGER NOT NULL,
+            order_id INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            before_state TEXT,
+            after_state TEXT,
+            undoes INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            invalidated INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_order_log_event ON order_log (event_id, seq);
+        CREATE INDEX IF NOT EXISTS idx_order_log_undoes
+            ON order_log (undoes) WHERE undoes IS NOT NULL;
+        """
+    )
+    migrate_order_log_invalidation(conn)
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_order_log_undo_stack ON order_log (event_id, seq)
+        WHERE undoes IS NULL AND NOT invalidated
+        """
+    )
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def init_event_archive(conn: sqlite3.Connection) -> None:
+    """Prepare the live database for closing events into an archive."""
+    event_columns = {row["name"] for row in conn.execute("PRAGMA table_info(events)")}
+    if "closed_at" not in event_columns:
+        conn.execute("ALTER TABLE events ADD COLUMN closed_at TIMESTAMP")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS event_totals (
+            event_id INTEGER NOT NULL,
+            participant_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            orders INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            yen INTEGER NOT NULL,
+            PRIMARY KEY (event_id, participant_id)
+        )
+        """
+    )
+    conn.commit()
+
+
+def enable_incremental_vacuum(conn: sqlite3.Connection) -> None:
+    """Let closing an event hand its free pages back with incremental_vacuum.
+
+    The mode only takes effect after a full VACUUM, which rewrites the whole
+    file once; it is kept out of init_db so that merely reading a database
+    never pays for (or causes) that rewrite.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+
+
+def init_change_log(conn: sqlite3.Connection) -> None:
+    """Create the change log and the triggers that append to it."""
+    # No event index: polls read a short seq range at the end of the log,
+    # and every logged row would otherwise pay for an index update too.
+    statements = [
+        """
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY,
+            event_id INTEGER NOT NULL,
+            table_name TEXT NOT NULL,
+            op TEXT NOT NULL,
+            row_id INTEGER NOT NULL
+        )
+        """
+    ]
+    for table, key in CHANGE_LOGGED_TABLES.items():
+        ops = [("insert", "NEW"), ("delete", "OLD")]
+        if table == "orders":
+            # Amended orders are updated in place.
+            ops.append(("update", "NEW"))
+        for op, row in ops:
+            statements.append(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{op}_log
+                AFTER {op.upper()} ON {table}
+                BEGIN
+                    INSERT INTO changes (event_id, table_name, op, row_id)
+                    VALUES ({row}.event_id, '{table}', '{op}', {row}.{key});
+                END
+                """
+            )
+    with conn:
+        for statement in statements:
+            conn.execute(statement)
+
+
+def prune_changes(conn: sqlite3.Connection, keep: int = CHANGE_LOG_RETENTION) -> None:
+    # The newest row always survives: seq is a plain rowid (AUTOINCREMENT
+    # would cost a sqlite_sequence update per logged row), so it only keeps
+    # growing while the table is not empty.
+    with conn:
+        conn.execute(
+            "DELETE FROM changes WHERE seq <= ?",
+            (latest_change_seq(conn) - max(keep, 1),),
+        )
+
+
+def latest_change_seq(conn: sqlite3.Connection) -> int:
+    return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+
+
+def fetch_changes(
+    conn: sqlite3.Connection, event_id: int, since: int
+) -> list[dict] | None:
+    """Return the changes of an event after sequence number ``since``.
+
+    ``None`` means the log no longer reaches back to ``since`` and the
+    caller has to reload everything.
+    """
+    oldest = conn.execute("SELECT MIN(seq) FROM changes").fetchone()[0]
+    if oldest is not None and since < oldest - 1:
+        return None
+    rows = conn.execute(
+        """
+        SELECT seq, table_name, op, row_id FROM changes
+        WHERE seq > ? AND event_id = ?
+        ORDER BY seq
+        """,
+        (since, event_id),
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def migrate_to_events(conn: sqlite3.Connection) -> None:
+    """Move data from the single-party schema into the default event."""
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(participants)")}
+    if "event_id" in columns:
+        return
+    # The participant name constraint changes, so the table has to be rebuilt.
+    # Foreign keys are switched off meanwhile so dropping the old table does
+    # not cascade into order_shares.
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        conn.executescript(
+            """
+            BEGIN;
+            CREATE TABLE participants_new (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                event_id INTEGER NOT NULL DEFAULT 1,
+                name TEXT NOT NULL,
+                UNIQUE (event_id, name)
+            );
+            INSERT INTO participants_new (id, name) SELECT id, name FROM participants;
+            DROP TABLE participants;
+            ALTER TABLE participants_new RENAME TO participants;
+            ALTER TABLE orders ADD COLUMN event_id INTEGER NOT NULL DEFAULT 1;
+            ALTER TABLE order_shares ADD COLUMN event_id INTEGER NOT NULL DEFAULT 1;
+            COMMIT;
+            """
+        )
+    finally:
+        conn.execute("PRAGMA foreign_keys = ON")
+
+
+def migrate_order_payers(conn: sqlite3.Connection) -> None:
+    """Add the optional payer of each order; a removed payer leaves it unset."""
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(orders)")}
+    if "payer_id" in columns:
+        return
+    with conn:
+        conn.execute(
+            """
+            ALTER TABLE orders ADD COLUMN payer_id INTEGER
+                REFERENCES participants(id) ON DELETE SET NULL
+            """
+        )
+
+
+def migrate_order_log_invalidation(conn: sqlite3.Connection) -> None:
+    """Flag the undo entries earlier participant removals left unrevertible.
+
+    Removals now flag them as they go; before, they were only recognised by
+    comparing each entry with its order while undoing, so that check runs
+    once here over the entries still on the undo stack.
+    """
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(order_log)")}
+    if "invalidated" in columns:
+        return
+    with conn:
+        conn.execute(
+            "ALTER TABLE order_log ADD COLUMN invalidated INTEGER NOT NULL DEFAULT 0"
+        )
+        event_ids = [row[0] for row in conn.execute("SELECT DISTINCT event_id FROM order_log")]
+        conn.executemany(
+            "UPDATE order_log SET invalidated = 1 WHERE seq = ?",
+            [
+                (entry["seq"],)
+                for event_id in event_ids
+                for entry in _undo_candidates(conn, event_id)
+                if not _can_undo(conn, event_id, entry)
+            ],
+        )
+
+
+def rebuild_balances(conn: sqlite3.Connection) -> None:
+    """Recompute the running balance of every participant from the orders."""
+    participant_ids = [row["id"] for row in conn.execute("SELECT id FROM participants")]
+    settlement = compute_settlement(fetch_share_rows(conn), participant_ids)
+    with conn:
+        conn.execute("DELETE FROM participant_balances")
+        conn.executemany(
+            "INSERT INTO participant_balances (participant_id, amount) VALUES (?, ?)",
+            zip(
+                settlement["participant_id"].tolist(),
+                settlement["amount"].tolist(),
+            ),
+        )
+
+
+def fetch_share_rows(
+    conn: sqlite3.Connection, event_id: int | None = None
+) -> pd.DataFrame:
+    """Return one row per (order, participant) pair with the order's total price.
+
+    All events are included unless ``event_id`` is given.
+    """
+    import pandas as pd
+
+    return pd.read_sql_query(
+        f"""
+        SELECT os.order_id, os.participant_id, o.unit_price * o.quantity AS total_price
+        FROM order_shares os
+        JOIN orders o ON o.id = os.order_id
+        {"WHERE os.event_id = ?" if event_id is not None else ""}
+        """,
+        conn,
+        params=(event_id,) if event_id is not None else None,
+    )
+
+
+def fetch_event_totals(conn: sqlite3.Connection, event_id: int) -> pd.DataFrame:
+    """Settle one event from scratch: exact and whole-yen amount per participant.
+
+    Closed events no longer have orders here and return their recorded totals.
+    """
+    if is_event_closed(conn, event_id):
+        import pandas as pd
+
+        return pd.read_sql_query(
+            """
+            SELECT participant_id, name, amount, yen FROM event_totals
+            WHERE event_id = ?
+            ORDER BY LOWER(name) COLLATE NOCASE
+            """,
+            conn,
+            params=(event_id,),
+        )
+    participants = fetch_participants(conn, event_id)
+    settlement = compute_settlement(
+        fetch_share_rows(conn, event_id), [p["id"] for p in participants]
+    )
+    settlement.insert(1, "name", [p["name"] for p in participants])
+    return settlement
+
+
+def fetch_transfers(conn: sqlite3.Connection, event_id: int) -> list[dict]:
+    """Who pays whom to settle the orders of an event that have a payer."""
+    return fetch_order_table(conn, event_id).transfers()
+
+
+def fetch_events(conn: sqlite3.Connection) -> list[dict]:
+    rows = conn.execute("SELECT id, name, closed_at FROM events ORDER BY id").fetchall()
+    return [dict(row) for row in rows]
+
+
+CLOSED_EVENT_MESSAGE = "このイベントは終了しているため変更できません。ページを更新してください。"
+
+
+def is_event_closed(conn: sqlite3.Connection, event_id: int) -> bool:
+    row = conn.execute("SELECT closed_at FROM events WHERE id = ?", (event_id,)).fetchone()
+    return row is not None and row["closed_at"] is not None
+
+
+def create_event(conn: sqlite3.Connection, name: str) -> tuple[int | None, str | None]:
+    try:
+        with conn:
+            cursor = conn.execute("INSERT INTO events(name) VALUES (?)", (name,))
+        return cursor.lastrowid, None
+    except sqlite3.IntegrityError:
+        return None, "同じ名前のイベントがすでに存在します。"
+
+
+def fetch_participants(conn: sqlite3.Connection, event_id: int) -> list[dict]:
+    rows = conn.execute(
+        """
+        SELECT id, name FROM participants
+        WHERE event_id = ?
+        ORDER BY LOWER(name) COLLATE NOCASE
+        """,
+        (event_id,),
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def fetch_balances(conn: sqlite3.Connection, event_id: int) -> list[dict]:
+    rows = conn.execute(
+        """
+        SELECT p.id, p.name, COALESCE(b.amount, 0) AS amount
+        FROM participants p
+        LEFT JOIN participant_balances b ON b.participant_id = p.id
+        WHERE p.event_id = ?
+        ORDER BY LOWER(p.name) COLLATE NOCASE
+        """,
+        (event_id,),
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def _build_orders(
+    order_rows: list[sqlite3.Row], share_rows: list[sqlite3.Row]
+) -> list[dict]:
+    share_map: dict[int, dict[str, list]] = {}
+    for row in share_rows:
+        entry = share_map.setdefault(row["order_id"], {"names": [], "ids": []})
+        entry["names"].append(row["name"])
+        entry["ids"].append(row["participant_id"])
+
+    orders: list[dict] = []
+    for row in order_rows:
+        shares = share_map.get(row["id"], {"names": [], "ids": []})
+        orders.append(
+            {
+                "id": row["id"],
+                "created_at": row["created_at"],
+                "drink_name": row["drink_name"],
+                "unit_price": float(row["unit_price"]),
+                "quantity": int(row["quantity"]),
+                "memo": row["memo"] or "",
+                "category": row["category"] or "",
+                "input_mode": row["input_mode"] or "",
+                "payer_id": row["payer_id"],
+                "share_with": shares["names"],
+                "share_with_ids": shares["ids"],
+            }
+        )
+
+    return orders
+
+
+def fetch_orders(conn: sqlite3.Connection, event_id: int) -> list[dict]:
+    return fetch_order_table(conn, event_id).to_dicts()
+
+
+def fetch_order_page(
+    conn: sqlite3.Connection,
+    event_id: int,
+    *,
+    after: tuple[str, int] | None = None,
+    limit: int = ORDER_PAGE_SIZE,
+    participant_id: int | None = None,
+    category: str | None = None,
+    drink_keyword: str = "",
+) -> list[dict]:
+    """Fetch the orders that follow the keyset cursor ``(created_at, id)``.
+
+    Only the share rows of the returned orders are read, so the cost depends
+    on the page size rather than on the size of the event.
+    """
+    clauses = ["event_id = ?"]
+    params: list = [event_id]
+    if after is not None:
+        clauses.append("(created_at, id) > (?, ?)")
+        params.extend(after)
+    if participant_id is not None:
+        clauses.append(
+            "id IN (SELECT order_id FROM order_shares WHERE participant_id = ?)"
+        )
+        params.append(participant_id)
+    if category is not None:
+        clauses.append("category = ?")
+        params.append(category)
+    if drink_keyword:
+        escaped = (
+            drink_keyword.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        )
+        clauses.append("drink_name LIKE ? ESCAPE '\\'")
+        params.append(f"%{escaped}%")
+
+    order_rows = conn.execute(
+        f"""
+        SELECT id, created_at, drink_name, unit_price, quantity, memo, category, input_mode,
+               payer_id
+        FROM orders
+        WHERE {" AND ".join(clauses)}
+        ORDER BY created_at, id
+        LIMIT ?
+        """,
+        (*params, limit),
+    ).fetchall()
+    if not order_rows:
+        return []
+
+    placeholders = ", ".join("?" for _ in order_rows)
+    share_rows = conn.execute(
+        f"""
+        SELECT os.order_id, p.id as participant_id, p.name
+        FROM order_shares os
+        JOIN participants p ON p.id = os.participant_id
+        WHERE os.order_id IN ({placeholders})
+        ORDER BY os.order_id, LOWER(p.name) COLLATE NOCASE
+        """,
+        [row["id"] for row in order_rows],
+    ).fetchall()
+
+    return _build_orders(order_rows, share_rows)
+
+
+def add_participant(
+    conn: sqlite3.Connection, event_id: int, name: str
+) -> tuple[bool, str | None]:
+    try:
+        with conn:
+            if is_event_closed(conn, event_id):
+                return False, CLOSED_EVENT_MESSAGE
+            cursor = conn.execute(
+                "INSERT INTO participants(event_id, name) VALUES (?, ?)", (event_id, name)
+            )
+            conn.execute(
+                "INSERT INTO participant_balances (participant_id, amount) VALUES (?, 0)",
+                (cursor.lastrowid,),
+            )
+        return True, None
+    except sqlite3.IntegrityError:
+        return False, "同じ名前の参加者がすでに存在します。"
+
+
+def remove_participant(
+    conn: sqlite3.Connection, event_id: int, participant_id: int
+) -> tuple[bool, str | None]:
+    return remove_participants(conn, event_id, [participant_id])
+
+
+def remove_participants(
+    conn: sqlite3.Connection, event_id: int, participant_ids: list[int]
+) -> tuple[bool, str | None]:
+    """Remove several participants of an event in a single transaction.
+
+    Only the orders the removed participants were sharing are touched: their
+    remaining sharers absorb the removed parts and orders left without any
+    sharer are deleted.
+    """
+    if not participant_ids:
+        return True, None
+    placeholders = ", ".join("?" for _ in participant_ids)
+    with conn:
+        if is_event_closed(conn, event_id):
+            return False, CLOSED_EVENT_MESSAGE
+        shared_orders = conn.execute(
+            f"""
+            SELECT
+                o.id,
+                o.unit_price * o.quantity AS total_price,
+                COUNT(*) AS sharers,
+                SUM(os.participant_id IN ({placeholders})) AS removed
+            FROM orders o
+            JOIN order_shares os ON os.order_id = o.id
+            WHERE o.event_id = ? AND o.id IN (
+                SELECT order_id FROM order_shares WHERE participant_id IN ({placeholders})
+            )
+            GROUP BY o.id
+            """,
+            (*participant_ids, event_id, *participant_ids),
+        ).fetchall()
+        touched_orders = {row["id"] for row in shared_orders}
+        touched_orders.update(
+            row[0]
+            for row in conn.execute(
+                f"SELECT id FROM orders WHERE event_id = ? AND payer_id IN ({placeholders})",
+                (event_id, *participant_ids),
+            )
+        )
+        _invalidate_undo_entries(conn, event_id, touched_orders, set(participant_ids))
+        conn.execute(
+            f"DELETE FROM participants WHERE event_id = ? AND id IN ({placeholders})",
+            (event_id, *participant_ids),
+        )
+        # The remaining sharers of each order absorb the removed participants' part.
+        conn.executemany(
+            """
+            UPDATE participant_balances
+            SET amount = amount + ?
+            WHERE participant_id IN (
+                SELECT participant_id FROM order_shares WHERE order_id = ?
+            )
+            """,
+            [
+                (
+                    row["total_price"] / (row["sharers"] - row["removed"])
+                    - row["total_price"] / row["sharers"],
+                    row["id"],
+                )
+                for row in shared_orders
+                if row["sharers"] > row["removed"]
+            ],
+        )
+        # Clean up orders that no longer have any participants.
+        conn.executemany(
+            "DELETE FROM orders WHERE id = ?",
+            [
+                (row["id"],)
+                for row in shared_orders
+                if row["sharers"] == row["removed"]
+            ],
+        )
+    return True, None
+
+
+def add_order(
+    conn: sqlite3.Connection,
+    *,
+    event_id: int,
+    drink_name: str,
+    unit_price: float,
+    quantity: int,
+    memo: str,
+    category: str,
+    input_mode: str,
+    participant_ids: list[int],
+    payer_id: int | None = None,
+) -> tuple[bool, str | None]:
+    share = unit_price * quantity / len(participant_ids)
+    values = (drink_name, unit_price, quantity, memo, category, input_mode, payer_id)
+    with conn:
+        if is_event_closed(conn, event_id):
+            return False, CLOSED_EVENT_MESSAGE
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""
+            INSERT INTO orders (event_id, {", ".join(ORDER_STATE_FIELDS)})
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (event_id, *values),
+        )
+        order_id = cursor.lastrowid
+        cursor.executemany(
+            "INSERT INTO order_shares (order_id, participant_id, event_id) VALUES (?, ?, ?)",
+            [(order_id, pid, event_id) for pid in participant_ids],
+        )
+        cursor.execute(
+            """
+            INSERT INTO order_log (event_id, order_id, action, after_state)
+            VALUES (?, ?, 'add', ?)
+            """,
+            (
+                event_id,
+                order_id,
+                _dump_state(values, participant_ids),
+            ),
+        )
+        cursor.executemany(
+            """
+            INSERT INTO participant_balances (participant_id, amount) VALUES (?, ?)
+            ON CONFLICT(participant_id) DO UPDATE SET amount = amount + excluded.amount
+            """,
+            [(pid, share) for pid in participant_ids],
+        )
+    return True, None
+
+
+def _insert_orders(
+    conn: sqlite3.Connection,
+    event_id: int,
+    orders: list[tuple],
+    shares: list[list[int]],
+) -> None:
+    """Bulk-insert orders, their shares and ledger updates.
+
+    Must run inside a ``BEGIN IMMEDIATE`` transaction: the order ids are
+    reserved up front so every table is written with one ``executemany``.
+    """
+    balances: dict[int, float] = {}
+    for order, participant_ids in zip(orders, shares):
+        share = order[2] * order[3] / len(participant_ids)
+        for pid in participant_ids:
+            balances[pid] = balances.get(pid, 0.0) + share
+
+    first_id = conn.execute(
+        """
+        SELECT MAX(
+            COALESCE((SELECT MAX(id) FROM orders), 0),
+            COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'orders'), 0)
+        ) + 1
+        """
+    ).fetchone()[0]
+    conn.executemany(
+        f"""
+        INSERT INTO orders (id, event_id, {", ".join(ORDER_STATE_FIELDS)})
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        [(first_id + idx, *order) for idx, order in enumerate(orders)],
+    )
+    conn.executemany(
+        "INSERT INTO order_shares (order_id, participant_id, event_id) VALUES (?, ?, ?)",
+        [
+            (first_id + idx, pid, event_id)
+            for idx, participant_ids in enumerate(shares)
+            for pid in participant_ids
+        ],
+    )
+    conn.executemany(
+        """
+        INSERT INTO participant_balances (participant_id, amount) VALUES (?, ?)
+        ON CONFLICT(participant_id) DO UPDATE SET amount = amount + excluded.amount
+        """,
+        balances.items(),
+    )
+    conn.executemany(
+        """
+        INSERT INTO order_log (event_id, order_id, action, after_state)
+        VALUES (?, ?, 'add', ?)
+        """,
+        [
+            (event_id, first_id + idx, _dump_state(order[1:], participant_ids))
+            for idx, (order, participant_ids) in enumerate(zip(orders, shares))
+        ],
+    )
+
+
+def add_orders(
+    conn: sqlite3.Connection, event_id: int, orders: list[dict]
+) -> tuple[int, str | None]:
+    """Record a whole round of orders in one transaction.
+
+    Each dict carries the keyword arguments of ``add_order`` except
+    ``event_id``. Nothing is written if a sharer or payer has been removed
+    from the event in the meantime.
+    """
+    rows = [
+        (
+            event_id,
+            order["drink_name"],
+            order["unit_price"],
+            order["quantity"],
+            order["memo"],
+            order["category"],
+            order["input_mode"],
+            order.get("payer_id"),
+        )
+        for order in orders
+    ]
+    shares = [list(order["participant_ids"]) for order in orders]
+    involved = {pid for participant_ids in shares for pid in participant_ids}
+    involved.update(row[-1] for row in rows if row[-1] is not None)
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        if is_event_closed(conn, event_id):
+            return 0, CLOSED_EVENT_MESSAGE
+        known = {
+            row[0]
+            for row in conn.execute(
+                "SELECT id FROM participants WHERE event_id = ?", (event_id,)
+            )
+        }
+        if not involved <= known:
+            return 0, "削除された参加者が含まれています。割り勘する参加者を選び直してください。"
+        _insert_orders(conn, event_id, rows, shares)
+    return len(rows), None
+
+
+# Accepted CSV headers for each import field, including common POS export names.
+IMPORT_COLUMN_ALIASES = {
+    "drink": ("drink", "drink_name", "ドリンク", "商品名", "品名"),
+    "quantity": ("quantity", "qty", "数量", "杯数"),
+    "unit_price": ("unit_price", "price", "単価", "価格"),
+    "participants": ("participants", "share_with", "割り勘する人", "参加者"),
+    "memo": ("memo", "メモ", "備考"),
+    "payer": ("payer", "paid_by", "支払者", "支払った人"),
+}
+PARTICIPANT_SEPARATORS = ("/", "、", ";")
+
+
+def parse_order_csv(text: str) -> list[dict[str, str]]:
+    """Read an order CSV into rows keyed by the fields of IMPORT_COLUMN_ALIASES."""
+    reader = csv.DictReader(io.StringIO(text))
+    columns: dict[str, str] = {}
+    for header in reader.fieldnames or []:
+        for field, aliases in IMPORT_COLUMN_ALIASES.items():
+            if header.strip().casefold() in aliases and field not in columns:
+                columns[field] = header
+    return [
+        {field: (row.get(header) or "").strip() for field, header in columns.items()}
+        for row in reader
+    ]
+
+
+def import_orders(
+    conn: sqlite3.Connection,
+    event_id: int,
+    rows: list[dict[str, str]],
+    menu: Menu,
+) -> tuple[int, list[str]]:
+    """Validate and insert many orders in a single transaction.
+
+    Each row needs ``drink`` and may carry ``quantity`` (default 1),
+    ``unit_price`` (default: the menu price), ``participants`` separated by
+    ``/`` (default: everyone in the event), ``memo`` and ``payer``. Nothing
+    is written if any row is invalid; the error messages are returned instead.
+    """
+    if is_event_closed(conn, event_id):
+        # Checked up front too, so rows are not reported against an empty event.
+        return 0, [CLOSED_EVENT_MESSAGE]
+    name_to_id = {
+        row["name"]: row["id"]
+        for row in conn.execute(
+            "SELECT id, name FROM participants WHERE event_id = ?", (event_id,)
+        )
+    }
+    everyone = list(name_to_id.values())
+    orders: list[tuple] = []
+    shares: list[list[int]] = []
+    errors: list[str] = []
+    for line, row in enumerate(rows, start=2):
+        drink_name = row.get("drink", "")
+        category, menu_price = menu.prices.get(drink_name, ("自由入力", None))
+        try:
+            quantity = int(row.get("quantity") or 1)
+            unit_price = float(row.get("unit_price") or menu_price or 0)
+            if not math.isfinite(unit_price):
+                # float() accepts "nan" and "inf", which would poison the ledger.
+                raise ValueError(unit_price)
+        except ValueError:
+            errors.append(f"{line}行目: 数量または単価が数値ではありません。")
+            continue
+        raw_names = row.get("participants", "")
+        for separator in PARTICIPANT_SEPARATORS:
+            raw_names = raw_names.replace(separator, ",")
+        names = [name.strip() for name in raw_names.split(",") if name.strip()]
+        payer = row.get("payer", "")
+        unknown = [name for name in [*names, payer] if name and name not in name_to_id]
+
+        if not drink_name:
+            errors.append(f"{line}行目: ドリンク名がありません。")
+        elif unit_price <= 0:
+            errors.append(f"{line}行目: {drink_name} の単価が分かりません。")
+        elif quantity < 1:
+            errors.append(f"{line}行目: 数量は1以上にしてください。")
+        elif unknown:
+            errors.append(f"{line}行目: 参加者が見つかりません: {', '.join(unknown)}")
+        elif not (names or everyone):
+            errors.append(f"{line}行目: 割り勘する参加者がいません。")
+        else:
+            orders.append(
+                (
+                    event_id,
+                    drink_name,
+                    unit_price,
+                    quantity,
+                    row.get("memo", ""),
+                    category,
+                    "メニュー" if menu_price is not None else "自由入力",
+                    name_to_id.get(payer),
+                )
+            )
+            participant_ids = list(dict.fromkeys(name_to_id[name] for name in names))
+            shares.append(participant_ids or everyone)
+    if errors or not orders:
+        return 0, errors
+
+    with conn:
+        # Take the write lock up front so the order ids reserved below stay ours.
+        conn.execute("BEGIN IMMEDIATE")
+        if is_event_closed(conn, event_id):
+            return 0, [CLOSED_EVENT_MESSAGE]
+        _insert_orders(conn, event_id, orders, shares)
+    return len(orders), []
+
+
+def clear_event(conn: sqlite3.Connection, event_id: int) -> None:
+    """Delete every participant and order of one event using the event indexes."""
+    with conn:
+        delete_event_rows(conn, event_id)
+
+
+def delete_event_rows(conn: sqlite3.Connection, event_id: int) -> None:
+    """Like :func:`clear_event`, inside the caller's transaction."""
+    conn.execute(
+        """
+        DELETE FROM participant_balances
+        WHERE participant_id IN (SELECT id FROM participants WHERE event_id = ?)
+        """,
+        (event_id,),
+    )
+    conn.execute("DELETE FROM order_shares WHERE event_id = ?", (event_id,))
+    conn.execute("DELETE FROM orders WHERE event_id = ?", (event_id,))
+    conn.execute("DELETE FROM participants WHERE event_id = ?", (event_id,))
+    conn.execute("DELETE FROM order_log WHERE event_id = ?", (event_id,))
+
+
+# Order fields kept in the log, in the column order of the orders table.
+ORDER_STATE_FIELDS = (
+    "drink_name",
+    "unit_price",
+    "quantity",
+    "memo",
+    "category",
+    "input_mode",
+    "payer_id",
+)
+ORDER_ACTION_LABELS = {"add": "追加", "void": "取り消し", "amend": "修正"}
+
+
+def _dump_state(values, participant_ids: list[int]) -> str:
+    state = dict(zip(ORDER_STATE_FIELDS, values))
+    state["participant_ids"] = list(participant_ids)
+    return json.dumps(state, ensure_ascii=False)
+
+
+def _current_order_state(
+    conn: sqlite3.Connection, event_id: int, order_id: int
+) -> dict | None:
+    row = conn.execute(
+        f"""
+        SELECT {", ".join(ORDER_STATE_FIELDS)}, created_at
+        FROM orders WHERE id = ? AND event_id = ?
+        """,
+        (order_id, event_id),
+    ).fetchone()
+    if row is None:
+        return None
+    state = dict(row)
+    state["participant_ids"] = [
+        share[0]
+        for share in conn.execute(
+            "SELECT participant_id FROM order_shares WHERE order_id = ?", (order_id,)
+        )
+    ]
+    return state
+
+
+def _set_order_state(
+    conn: sqlite3.Connection,
+    event_id: int,
+    order_id: int,
+    old: dict | None,
+    new: dict | None,
+) -> None:
+    """Move one order from ``old`` to ``new`` (``None``: absent), ledger included."""
+    ledger: dict[int, float] = {}
+    for state, sign in ((old, -1), (new, 1)):
+        if state:
+            share = state["unit_price"] * state["quantity"] / len(state["participant_ids"])
+            for pid in state["participant_ids"]:
+                ledger[pid] = ledger.get(pid, 0.0) + sign * share
+
+    # Entries logged before payers existed have no payer_id.
+    values = [new.get(field) for field in ORDER_STATE_FIELDS] if new else []
+    if old is None:
+        conn.execute(
+            f"""
+            INSERT INTO orders (id, event_id, {", ".join(ORDER_STATE_FIELDS)}, created_at)
+            VALUES (?, ?, {", ".join("?" for _ in ORDER_STATE_FIELDS)},
+                    COALESCE(?, CURRENT_TIMESTAMP))
+            """,
+            (order_id, event_id, *values, new.get("created_at")),
+        )
+    elif new is None:
+        conn.execute("DELETE FROM orders WHERE id = ?", (order_id,))
+    else:
+        conn.execute(
+            f"""
+            UPDATE orders SET {", ".join(f"{field} = ?" for field in ORDER_STATE_FIELDS)}
+            WHERE id = ?
+            """,
+            (*values, order_id),
+        )
+    if new is not None and (old is None or old["participant_ids"] != new["participant_ids"]):
+        conn.execute("DELETE FROM order_shares WHERE order_id = ?", (order_id,))
+        conn.executemany(
+            "INSERT INTO order_shares (order_id, participant_id, event_id) VALUES (?, ?, ?)",
+            [(order_id, pid, event_id) for pid in new["participant_ids"]],
+        )
+    conn.executemany(
+        """
+        INSERT INTO participant_balances (participant_id, amount) VALUES (?, ?)
+        ON CONFLICT(participant_id) DO UPDATE SET amount = amount + excluded.amount
+        """,
+        ledger.items(),
+    )
+
+
+def _log_order_action(
+    conn: sqlite3.Connection,
+    event_id: int,
+    order_id: int,
+    action: str,
+    old: dict | None,
+    new: dict | None,
+    undoes: int | None = None,
+) -> None:
+    conn.execute(
+        """
+        INSERT INTO order_log (event_id, order_id, action, before_state, after_state, undoes)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        (
+            event_id,
+            order_id,
+            action,
+            json.dumps(old, ensure_ascii=False) if old else None,
+            json.dumps(new, ensure_ascii=False) if new else None,
+            undoes,
+        ),
+    )
+
+
+def _state_participants(state: dict) -> set[int]:
+    """The sharers and the payer (if any) of a logged order state."""
+    involved = set(state["participant_ids"])
+    if state.get("payer_id") is not None:
+        involved.add(state["payer_id"])
+    return involved
+
+
+def _missing_participants(conn: sqlite3.Connection, event_id: int, state: dict) -> bool:
+    """Whether a sharer or the payer of an order state has left the event."""
+    known = {
+        row[0]
+        for row in conn.execute("SELECT id FROM participants WHERE event_id = ?", (event_id,))
+    }
+    return not _state_participants(state) <= known
+
+
+def void_order(
+    conn: sqlite3.Connection, event_id: int, order_id: int
+) -> tuple[bool, str | None]:
+    """Cancel one order; its sharers' balances are reduced accordingly."""
+    with conn:
+        if is_event_closed(conn, event_id):
+            return False, CLOSED_EVENT_MESSAGE
+        old = _current_order_state(conn, event_id, order_id)
+        if old is None:
+            return False, "注文が見つかりません。"
+        _set_order_state(conn, event_id, order_id, old, None)
+        _log_order_action(conn, event_id, order_id, "void", old, None)
+    return True, None
+
+
+def amend_order(
+    conn: sqlite3.Connection, event_id: int, order_id: int, **changes
+) -> tuple[bool, str | None]:
+    """Change fields of one order (any of ``ORDER_STATE_FIELDS`` and ``participant_ids``)."""
+    with conn:
+        if is_event_closed(conn, event_id):
+            return False, CLOSED_EVENT_MESSAGE
+        old = _current_order_state(conn, event_id, order_id)
+        if old is None:
+            return False, "注文が見つかりません。"
+        new = {**old, **changes}
+        if not new["participant_ids"]:
+            return False, "割り勘する参加者を選択してください。"
+        if new["unit_price"] <= 0 or new["quantity"] < 1:
+            return False, "単価と杯数は0より大きい値にしてください。"
+        if _missing_participants(conn, event_id, new):
+            return False, "削除された参加者が含まれています。"
+        if new == old:
+            return True, None
+        _set_order_state(conn, event_id, order_id, old, new)
+        _log_order_action(conn, event_id, order_id, "amend", old, new)
+    return True, None
+
+
+def _same_order_state(current: dict | None, logged: dict | None) -> bool:
+    if current is None or logged is None:
+        return current is logged
+    # Entries logged before payers existed have no payer_id.
+    same_fields = all(current[field] == logged.get(field) for field in ORDER_STATE_FIELDS)
+    return same_fields and sorted(current["participant_ids"]) == sorted(
+        logged["participant_ids"]
+    )
+
+
+def _can_undo(conn: sqlite3.Connection, event_id: int, entry: sqlite3.Row) -> bool:
+    """Whether the order still looks as the entry left it and can be put back."""
+    current = _current_order_state(conn, event_id, entry["order_id"])
+    logged = json.loads(entry["after_state"]) if entry["after_state"] else None
+    if not _same_order_state(current, logged):
+        return False
+    target = json.loads(entry["before_state"]) if entry["before_state"] else None
+    return target is None or not _missing_participants(conn, event_id, target)
+
+
+_UNDO_CANDIDATES = """
+    SELECT seq, order_id, action, before_state, after_state
+    FROM order_log AS entry
+    WHERE event_id = ? AND undoes IS NULL AND NOT invalidated
+      AND NOT EXISTS (SELECT 1 FROM order_log WHERE undoes = entry.seq)
+    ORDER BY seq DESC
+"""
+
+
+def _undo_candidates(conn: sqlite3.Connection, event_id: int) -> list[sqlite3.Row]:
+    """Entries still on the undo stack, newest first."""
+    return conn.execute(_UNDO_CANDIDATES, (event_id,)).fetchall()
+
+
+def _invalidate_undo_entries(
+    conn: sqlite3.Connection, event_id: int, order_ids: set[int], participant_ids: set[int]
+) -> None:
+    """Flag the entries a participant removal leaves unrevertible.
+
+    The removal changes or deletes ``order_ids`` without a log entry, and a
+    state naming a removed participant cannot be put back. Once an entry is
+    flagged, the older entries of its order are too: they could only be
+    undone after it. Flagging them in the removal's transaction keeps the
+    undo lookup a single indexed row.
+    """
+    stale = []
+    broken_orders = set(order_ids)
+    for entry in _undo_candidates(conn, event_id):
+        states = [json.loads(raw) for raw in (entry["before_state"], entry["after_state"]) if raw]
+        if any(_state_participants(state) & participant_ids for state in states):
+            broken_orders.add(entry["order_id"])
+        if entry["order_id"] in broken_orders:
+            stale.append((entry["seq"],))
+    conn.executemany("UPDATE order_log SET invalidated = 1 WHERE seq = ?", stale)
+
+
+def _last_undoable_entry(conn: sqlite3.Connection, event_id: int) -> sqlite3.Row | None:
+    return conn.execute(f"{_UNDO_CANDIDATES} LIMIT 1", (event_id,)).fetchone()
+
+
+def describe_last_order_action(
+    conn: sqlite3.Connection, event_id: int
+) -> tuple[int, str] | None:
+    """Return the seq and a description of what ``undo_last_order_action`` reverts."""
+    entry = _last_undoable_entry(conn, event_id)
+    if entry is None:
+        return None
+    state = json.loads(entry["after_state"] or entry["before_state"])
+    return entry["seq"], f"{state['drink_name']} の{ORDER_ACTION_LABELS[entry['action']]}"
+
+
+def undo_last_order_action(
+    conn: sqlite3.Connection, event_id: int, seq: int | None = None
+) -> tuple[bool, str | None]:
+    """Revert the latest add / void / amend of the event that is not undone yet.
+
+    The undo is appended to the log as the inverse action, so repeated
+    calls walk back through the history. Entries whose order has since been
+    changed by a participant removal are skipped. With ``seq`` (from
+    ``describe_last_order_action``) nothing is undone unless that entry is
+    still the latest one, so a label shown before another device's write
+    never reverts that write instead.
+    """
+    with conn:
+        if is_event_closed(conn, event_id):
+            return False, CLOSED_EVENT_MESSAGE
+        entry = _last_undoable_entry(conn, event_id)
+        if entry is None:
+            return False, "元に戻せる操作がありません。"
+        if seq is not None and entry["seq"] != seq:
+            return False, "他の端末で注文が変更されたため、元に戻しませんでした。表示を確認してください。"
+        order_id = entry["order_id"]
+        current = _current_order_state(conn, event_id, order_id)
+        target = json.loads(entry["before_state"]) if entry["before_state"] else None
+        _set_order_state(conn, event_id, order_id, current, target)
+        inverse = {"add": "void", "void": "add", "amend": "amend"}[entry["action"]]
+        _log_order_action(conn, event_id, order_id, inverse, current, target, entry["seq"])
+    return True, None
@@ -1,264 +1,226 @@
 from __future__ import annotations
 
-import sqlite3
+import functools
+import io
+import os
+import threading
+import time
+from collections.abc import Callable
+from contextlib import nullcontext
 from pathlib import Path
+from typing import TYPE_CHECKING
 
+import numpy as np
 import streamlit as st
-import pandas as pd
-
-# メニュー情報: (ドリンク名, 価格) 価格が未設定の場合はNone
-MENU_DATA = {
-    "ビール": [
-        ("アサヒスーパードライ生中", 638),
-        ("ドライゼロ", 539),
-        ("ノンアルコールビール", 539),
-        ("ホッピーセット（白・黒）", 539),
-        ("ホッピー中", 220),
-        ("ホッピー外（白・黒）", 363),
-    ],
-    "ご当地サワー": [
-        ("北海道ぶどうサワー", 539),
-        ("青森県りんごサワー", 539),
-        ("山形県白桃サワー", 539),
-        ("高知県生姜おろしサワー", 539),
-        ("宮崎県日向夏サワー", 539),
-        ("福岡県あまおうサワー", 539),
-        ("鹿児島県島みかんサワー", 539),
-        ("沖縄県トマトサワー", 539),
-    ],
-    "サワー": [
-        ("モンスターサワー", 590),
-        ("黒い1800サワー", 690),
-        ("レモンサワー", 649),
-        ("最強レモンサワー", 649),
-        ("生レモンサワー", 539),
-        ("ガリガリ君サワー", 539),
-        ("カルピスサワー", 539),
-        ("サイダーサワー", 539),
-        ("生グレープフルーツサワー", 539),
-        ("梅干しサワー", 539),
-        ("ドデカミンサワー", 539),
-    ],
-    "健康茶ハイ": [
-        ("プーロン茶ハイ", 539),
-        ("ウーロンハイ", 440),
-        ("緑茶ハイ", 440),
-        ("コーン茶ハイ", 440),
-        ("平木さんの親友青汁ハイ", 539),
-    ],
-    "ハイボール": [
-        ("ニッカフロンティアハイボール", 690),
-        ("ふたごハイボール", 539),
-        ("ジンジャーハイボール", 539),
-        ("コーラハイボール", 539),
-        ("ドデカミンハイボール", 539),
-        ("最強レモンハイボール", 649),
-    ],
-    "ワイン・スパークリング": [
-        ("はみ出るワイン（赤・白）", 649),
-        ("ドンペリニヨン", 33000),
-        ("カベルネソーヴィニヨンバロンフィリップ", 2959),
-        ("カベルネソーヴィニヨン バロンフィリップ", 2690),
-        ("シャルドネ バロンフィリップ", 2690),
-        ("コレクション", 7990),
-        ("ドンペリ祝", 30000),
-    ],
-    "果実酒": [
-        ("濃醇梅酒", 539),
-        ("あらごしみかん酒", 539),
-        ("バナナ梅酒", 539),
-    ],
-    "韓国酒": [
-        ("黒豆マッコリやかん", 1500),
-        ("黒豆マッコリグラス", 490),
-        ("セロ", 1400),
-        ("セロ（プレミアム）", 1540),
-        ("生マッコリやかん", 2200),
-        ("マッコリやかん", 1650),
-        ("マッコリグラス", 539),
-    ],
-    "焼酎・日本酒": [
-        ("㐂六 ロック", 590),
-        ("神の河 ロック", 590),
-        ("かのか ロック", 530),
-        ("黒霧島（グラス）", 605),
-        ("黒霧島（ボトル）一升瓶", 6050),
-        ("かのか（ボトル）", 583),
-        ("中々（グラス）", 616),
-        ("中々（ボトル）一升瓶", 6600),
-        ("富乃宝山（グラス）", 649),
-        ("富乃宝山（ボトル）一升瓶", 8800),
-        ("八海山", 869),
-    ],
-    "ソフトドリンク": [
-        ("モンスター", 390),
-        ("ウーロン茶", 319),
-        ("緑茶", 319),
-        ("コーン茶", 319),
-        ("プーロン茶", 319),
-        ("平木さんの親友青汁", 319),
-        ("オレンジジュース", 319),
-        ("アップルジュース", 319),
-        ("ジンジャエール", 319),
-        ("ドデカミン", 319),
-        ("三ツ矢サイダー", 319),
-        ("カルピス", 319),
-        ("俺じなるヨーグルト", 319),
-    ],
-}
-
-ALL_MENU_ITEMS = [
-    {"カテゴリー": category, "ドリンク": name, "価格": price}
-    for category, items in MENU_DATA.items()
-    for name, price in items
-]
 
+from alcal.archive import archive_path_for, close_event
+from alcal.columnar import fetch_order_table, refresh_order_table
+from alcal.export import PARQUET_AVAILABLE, write_ledger_csv, write_ledger_parquet
+from alcal.menu import MENU_SUFFIXES, Menu, parse_menu_file
+from alcal.profiling import RerunProfiler, active_profiler, profile_phase
+from alcal.reports import category_report, drink_report, hourly_report, person_report
+from alcal.settlement import allocate_yen
+from alcal.storage import (
+    DEFAULT_EVENT_ID,
+    ORDER_PAGE_SIZE,
+    Database,
+    add_order,
+    add_orders,
+    add_participant,
+    amend_order,
+    clear_event,
+    create_event,
+    describe_last_order_action,
+    enable_incremental_vacuum,
+    fetch_balances,
+    fetch_changes,
+    fetch_event_totals,
+    fetch_events,
+    fetch_order_page,
+    fetch_participants,
+    import_orders,
+    init_db,
+    latest_change_seq,
+    parse_order_csv,
+    prune_changes,
+    remove_participant,
+    remove_participants,
+    undo_last_order_action,
+    void_order,
+)
+
+# pandas is imported by the sections that build tables, so a page without
+# orders renders without paying for it.
+if TYPE_CHECKING:
+    import pandas as pd
+
+# メニュー情報: 店ごとに1ファイル (JSON / TOML / CSV)。価格が未設定の場合はnull/空欄
+MENU_DIR = Path(__file__).resolve().parent / "menus"
 DB_PATH = Path(__file__).resolve().parent / "drink_orders.db"
+# Closed events are moved here; only their final totals stay in DB_PATH.
+ARCHIVE_PATH = archive_path_for(DB_PATH)
+# Polling interval of the auto-refresh, and the number of changed orders
+# beyond which a full reload is cheaper than applying the delta.
+AUTO_REFRESH_SECONDS = 3
+MAX_DELTA_ORDERS = 500
+
+
+@st.cache_resource(show_spinner=False, max_entries=32)
+def load_menu_file(path: str, mtime_ns: int) -> Menu:
+    # mtime_ns is only part of the cache key: editing the file reloads it.
+    return Menu(parse_menu_file(Path(path)))
+
+
+def load_menus(menu_dir: Path) -> tuple[dict[str, Menu], list[str]]:
+    """Load every shop menu in ``menu_dir``, keyed by file name without suffix."""
+    menus: dict[str, Menu] = {}
+    errors: list[str] = []
+    paths = sorted(menu_dir.iterdir()) if menu_dir.is_dir() else []
+    for path in paths:
+        if path.suffix not in MENU_SUFFIXES:
+            continue
+        try:
+            menus[path.stem] = load_menu_file(str(path), path.stat().st_mtime_ns)
+        except (OSError, ValueError, KeyError, TypeError) as exc:
+            errors.append(f"{path.name}: {exc}")
+    return menus, errors
 
 
 @st.cache_resource(show_spinner=False)
-def get_connection(path: str):
-    conn = sqlite3.connect(path, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON")
-    return conn
-
-
-def init_db(conn: sqlite3.Connection) -> None:
-    conn.executescript(
-        """
-        CREATE TABLE IF NOT EXISTS participants (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL UNIQUE
-        );
-
-        CREATE TABLE IF NOT EXISTS orders (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            drink_name TEXT NOT NULL,
-            unit_price REAL NOT NULL,
-            quantity INTEGER NOT NULL,
-            memo TEXT,
-            category TEXT,
-            input_mode TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-
-        CREATE TABLE IF NOT EXISTS order_shares (
-            order_id INTEGER NOT NULL,
-            participant_id INTEGER NOT NULL,
-            PRIMARY KEY (order_id, participant_id),
-            FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE CASCADE,
-            FOREIGN KEY (participant_id) REFERENCES participants(id) ON DELETE CASCADE
-        );
-        """
-    )
-    conn.commit()
-
-
-def fetch_participants(conn: sqlite3.Connection) -> list[dict]:
-    rows = conn.execute(
-        "SELECT id, name FROM participants ORDER BY LOWER(name) COLLATE NOCASE"
-    ).fetchall()
-    return [dict(row) for row in rows]
-
-
-def fetch_orders(conn: sqlite3.Connection) -> list[dict]:
-    order_rows = conn.execute(
-        "SELECT id, drink_name, unit_price, quantity, memo, category, input_mode FROM orders ORDER BY created_at"
-    ).fetchall()
-
-    share_rows = conn.execute(
-        """
-        SELECT os.order_id, p.id as participant_id, p.name
-        FROM order_shares os
-        JOIN participants p ON p.id = os.participant_id
-        ORDER BY os.order_id, LOWER(p.name) COLLATE NOCASE
-        """
-    ).fetchall()
-
-    share_map: dict[int, dict[str, list]] = {}
-    for row in share_rows:
-        entry = share_map.setdefault(row["order_id"], {"names": [], "ids": []})
-        entry["names"].append(row["name"])
-        entry["ids"].append(row["participant_id"])
-
-    orders: list[dict] = []
-    for row in order_rows:
-        shares = share_map.get(row["id"], {"names": [], "ids": []})
-        orders.append(
-            {
-                "id": row["id"],
-                "drink_name": row["drink_name"],
-                "unit_price": float(row["unit_price"]),
-                "quantity": int(row["quantity"]),
-                "memo": row["memo"] or "",
-                "category": row["category"] or "",
-                "input_mode": row["input_mode"] or "",
-                "share_with": shares["names"],
-                "share_with_ids": shares["ids"],
-            }
-        )
+def get_database(path: str) -> Database:
+    # Schema setup and log pruning run once per process and database; reruns
+    # reuse the cached Database without touching the schema.
+    db = Database(path)
+    with db.writer() as conn:
+        init_db(conn)
+        enable_incremental_vacuum(conn)
+        prune_changes(conn)
+    return db
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def load_events(_db: Database, path: str, version: int) -> list[dict]:
+    with _db.reader() as conn:
+        return fetch_events(conn)
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def load_final_totals(_db: Database, path: str, event_id: int) -> pd.DataFrame:
+    # Closed events never change, so the recorded totals are cached for good.
+    with _db.reader() as conn:
+        return fetch_event_totals(conn, event_id)
+
 
-    return orders
-
-
-def add_participant(conn: sqlite3.Connection, name: str) -> tuple[bool, str | None]:
-    try:
-        conn.execute("INSERT INTO participants(name) VALUES (?)", (name,))
-        conn.commit()
-        return True, None
-    except sqlite3.IntegrityError:
-        return False, "同じ名前の参加者がすでに存在します。"
-
-
-def remove_participant(conn: sqlite3.Connection, participant_id: int) -> None:
-    conn.execute("DELETE FROM participants WHERE id = ?", (participant_id,))
-    # Clean up orders that no longer have any participants.
-    conn.execute(
-        """
-        DELETE FROM orders
-        WHERE id IN (
-            SELECT o.id
-            FROM orders o
-            LEFT JOIN order_shares os ON o.id = os.order_id
-            GROUP BY o.id
-            HAVING COUNT(os.order_id) = 0
+@st.cache_resource(show_spinner=False)
+def get_snapshot_store(path: str) -> dict:
+    # Latest snapshot per event, shared by every session and advanced with
+    # deltas from the change log instead of full reloads. Each event has its
+    # own lock, so a slow rebuild of one event does not hold up the others.
+    return {"lock": threading.Lock(), "event_locks": {}, "events": {}}
+
+
+def _event_lock(store: dict, event_id: int) -> threading.Lock:
+    with store["lock"]:
+        return store["event_locks"].setdefault(event_id, threading.Lock())
+
+
+def load_snapshot(db: Database, event_id: int) -> dict:
+    """Return the shared snapshot of an event; callers must not mutate it."""
+    store = get_snapshot_store(db.path)
+    with _event_lock(store, event_id), db.reader() as conn:
+        seq = latest_change_seq(conn)
+        snapshot = store["events"].get(event_id)
+        if snapshot is not None and snapshot["seq"] == seq:
+            return snapshot
+        changes = None if snapshot is None else fetch_changes(conn, event_id, snapshot["seq"])
+        if changes == []:
+            # Only other events changed.
+            snapshot = {**snapshot, "seq": seq}
+            store["events"][event_id] = snapshot
+            return snapshot
+
+        touched = {c["row_id"] for c in changes or () if c["table_name"] != "participants"}
+        if changes is None or len(touched) > MAX_DELTA_ORDERS:
+            orders = fetch_order_table(conn, event_id)
+        else:
+            orders = refresh_order_table(conn, event_id, snapshot["orders"], touched)
+        if changes is None or any(c["table_name"] == "participants" for c in changes):
+            participants = fetch_participants(conn, event_id)
+        else:
+            participants = snapshot["participants"]
+        snapshot = {
+            "seq": max(seq, changes[-1]["seq"] if changes else 0),
+            "revision": changes[-1]["seq"] if changes else seq,
+            "participants": participants,
+            "orders": orders,
+            "order_summary": {
+                "count": len(orders),
+                "categories": orders.active_categories,
+            },
+            "balances": fetch_balances(conn, event_id),
+            "transfers": orders.transfers(),
+            "last_action": describe_last_order_action(conn, event_id),
+            "unpaid": {
+                "count": int((orders.payer_ids == 0).sum()),
+                "amount": float(orders.total_prices[orders.payer_ids == 0].sum()),
+            },
+        }
+        store["events"][event_id] = snapshot
+        return snapshot
+
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def load_order_page(
+    _db: Database,
+    path: str,
+    event_id: int,
+    version: tuple[int, int],
+    after: tuple[str, int] | None,
+    participant_id: int | None,
+    category: str | None,
+    drink_keyword: str,
+) -> list[dict]:
+    # One extra row tells the caller whether a next page exists.
+    with _db.reader() as conn:
+        return fetch_order_page(
+            conn,
+            event_id,
+            after=after,
+            limit=ORDER_PAGE_SIZE + 1,
+            participant_id=participant_id,
+            category=category,
+            drink_keyword=drink_keyword,
         )
-        """
-    )
-    conn.commit()
-
-
-def add_order(
-    conn: sqlite3.Connection,
-    *,
-    drink_name: str,
-    unit_price: float,
-    quantity: int,
-    memo: str,
-    category: str,
-    input_mode: str,
-    participant_ids: list[int],
-) -> None:
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        INSERT INTO orders (drink_name, unit_price, quantity, memo, category, input_mode)
-        VALUES (?, ?, ?, ?, ?, ?)
-        """,
-        (drink_name, unit_price, quantity, memo, category, input_mode),
-    )
-    order_id = cursor.lastrowid
-    cursor.executemany(
-        "INSERT INTO order_shares (order_id, participant_id) VALUES (?, ?)",
-        [(order_id, pid) for pid in participant_ids],
-    )
-    conn.commit()
 
 
-def refresh_data(conn: sqlite3.Connection) -> None:
-    st.session_state.participants = fetch_participants(conn)
-    st.session_state.orders = fetch_orders(conn)
+@st.cache_data(show_spinner=False, max_entries=16)
+def load_reports(
+    _db: Database, path: str, version: int, event_id: int | None
+) -> dict[str, pd.DataFrame]:
+    with _db.reader() as conn:
+        return {
+            "drinks": drink_report(conn, event_id),
+            "categories": category_report(conn, event_id),
+            "hours": hourly_report(conn, event_id),
+            "people": person_report(conn, event_id),
+        }
+
+
+def refresh_data(db: Database) -> None:
+    # Skip all table reads while no connection has committed anything new.
+    event_id = st.session_state.event_id
+    version = (event_id, db.data_version())
+    if st.session_state.get("data_version") == version:
+        return
+    snapshot = load_snapshot(db, event_id)
+    st.session_state.snapshot_revision = (event_id, snapshot["revision"])
+    st.session_state.participants = snapshot["participants"]
+    st.session_state.order_summary = snapshot["order_summary"]
+    st.session_state.balances = snapshot["balances"]
+    st.session_state.transfers = snapshot["transfers"]
+    st.session_state.unpaid_orders = snapshot["unpaid"]
+    st.session_state.last_order_action = snapshot["last_action"]
+    st.session_state.data_version = version
 
 def trigger_rerun() -> None:
     """Streamlit rerun helper compatible with old/new APIs."""
@@ -268,6 +230,48 @@ def trigger_rerun() -> None:
         return
     rerun_func()
 
+def reset_menu_selection() -> None:
+    st.session_state.order_menu_index = 0
+    st.session_state._last_menu_selection = None
+
+def as_fragment(func=None, *, run_every: float | None = None):
+    """st.fragment compatible with old/new APIs; plain function if unsupported."""
+    if func is None:
+        return lambda func: as_fragment(func, run_every=run_every)
+    decorator = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+    if not decorator:
+        return func
+    func = profile_fragment(func)
+    return decorator(func, run_every=run_every) if run_every else decorator(func)
+
+def profiling_requested() -> bool:
+    # Opt-in profiling: ?debug=1 in the URL or ALCAL_PROFILE=1 in the environment.
+    # ALCAL_PROFILE_LOG=path additionally appends one JSON line per rerun.
+    return st.query_params.get("debug") == "1" or os.environ.get("ALCAL_PROFILE") == "1"
+
+def profile_fragment(func):
+    """Profile fragment-only reruns, which never reach the page's profiler."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if active_profiler() is not None or not profiling_requested():
+            return func(*args, **kwargs)
+        profiler = RerunProfiler()
+        with profiler.activate():
+            result = func(*args, **kwargs)
+        render_profile_panel(profiler, st.expander(f"デバッグ: 処理時間 ({func.__name__})"))
+        log_profile(profiler, fragment=func.__name__)
+        return result
+    return wrapper
+
+def flash(section: str, message: str, level: str = "success") -> None:
+    """Keep a message for ``section`` across the rerun after a write."""
+    st.session_state[f"_flash_{section}"] = (level, message)
+
+def show_flash(section: str) -> None:
+    level, message = st.session_state.pop(f"_flash_{section}", (None, None))
+    if message:
+        getattr(st, level)(message)
+
 def initialize_order_state() -> None:
     """Ensure order input widgets have sensible defaults."""
     if "order_input_mode" not in st.session_state:
@@ -314,7 +318,13 @@ def initialize_order_state() -> None:
         st.session_state._reset_order_mode = None
         st.session_state._last_menu_selection = None
 
+    if "order_payer" not in st.session_state:
+        st.session_state.order_payer = None
+
     available_names = {p["name"] for p in st.session_state.get("participants", [])}
+    available_ids = {p["id"] for p in st.session_state.get("participants", [])}
+    if st.session_state.order_payer not in available_ids:
+        st.session_state.order_payer = None
     if available_names:
         st.session_state.order_share_with = [
             name for name in st.session_state.order_share_with if name in available_names
@@ -347,266 +357,853 @@ def reset_order_inputs(input_mode: str) -> None:
     st.session_state._reset_order_pending = True
     st.session_state._reset_order_mode = input_mode
 
-st.set_page_config(page_title="飲み会ドリンク計算", layout="wide")
-
-conn = get_connection(str(DB_PATH))
-init_db(conn)
-refresh_data(conn)
-
-st.title("飲み放題じゃない時のドリンク割り勘ツール")
-st.caption("参加者と注文を追加すると自動で金額を集計します。")
-
-if ALL_MENU_ITEMS:
+@as_fragment
+def render_menu(menu: Menu) -> None:
     with st.expander("ドリンクメニュー一覧", expanded=False):
         search_keyword = st.text_input(
             "メニュー検索",
             placeholder="例: レモン / ハイボール",
             key="menu_search_keyword",
         )
-        menu_df = pd.DataFrame(ALL_MENU_ITEMS)
-        if search_keyword:
-            menu_df = menu_df[
-                menu_df["ドリンク"].str.contains(search_keyword, case=False, na=False)
-                | menu_df["カテゴリー"].str.contains(
-                    search_keyword, case=False, na=False
-                )
-            ]
-        menu_display_df = menu_df.copy()
-        menu_display_df["価格(円)"] = menu_display_df["価格"].apply(
-            lambda v: f"{int(v):,}" if isinstance(v, (int, float)) else "未設定"
+        # The expander body runs on every rerun even when collapsed, so the
+        # full list is only built on request.
+        show_all = st.checkbox(f"全{len(menu.items)}品を表示", key="menu_show_all")
+        if not (search_keyword or show_all):
+            return
+        import pandas as pd
+
+        menu_results = menu.search_index.search(search_keyword)
+        st.dataframe(
+            pd.DataFrame(menu_results, columns=["カテゴリー", "ドリンク", "価格(円)"]),
+            use_container_width=True,
         )
-        menu_display_df.drop(columns="価格", inplace=True)
-        st.dataframe(menu_display_df, use_container_width=True)
-
-with st.sidebar:
-    st.header("リセット")
-    if st.button("すべての入力をクリア", type="primary"):
-        conn.execute("DELETE FROM order_shares")
-        conn.execute("DELETE FROM orders")
-        conn.execute("DELETE FROM participants")
-        conn.commit()
-        refresh_data(conn)
-        reset_order_inputs(st.session_state.get("order_input_mode", "自由入力"))
-        st.success("データをリセットしました。")
-
-st.subheader("参加者の管理")
-with st.form("add_participant", clear_on_submit=True):
-    new_participant = st.text_input("参加者名を入力", max_chars=30)
-    add_participant = st.form_submit_button("参加者を追加")
-
-if add_participant:
-    name = new_participant.strip()
-    if not name:
-        st.warning("名前を入力してください。")
-    else:
-        success, error_msg = add_participant(conn, name)
-        if success:
-            refresh_data(conn)
-            st.success(f"{name} を追加しました。")
+
+
+@as_fragment(run_every=AUTO_REFRESH_SECONDS)
+def render_live_sync(db: Database) -> None:
+    # Cheap poll: data_version short-circuits refresh_data when nothing was
+    # committed, and the page only reruns when this event changed.
+    revision = st.session_state.get("snapshot_revision")
+    refresh_data(db)
+    if st.session_state.snapshot_revision != revision:
+        trigger_rerun()
+    st.caption(f"自動更新中 (最終確認 {time.strftime('%H:%M:%S')})")
+
+
+@as_fragment
+def render_participants(db: Database) -> None:
+    st.subheader("参加者の管理")
+    show_flash("participants")
+    with st.form("add_participant", clear_on_submit=True):
+        new_participant = st.text_input("参加者名を入力", max_chars=30)
+        add_participant_submitted = st.form_submit_button("参加者を追加")
+
+    if add_participant_submitted:
+        name = new_participant.strip()
+        if not name:
+            st.warning("名前を入力してください。")
         else:
-            st.warning(error_msg or "参加者の追加に失敗しました。")
-
-participants_data = st.session_state.participants
-if participants_data:
-    cols = st.columns(3)
-    for idx, participant in enumerate(participants_data):
-        col = cols[idx % len(cols)]
-        name = participant["name"]
-        participant_id = participant["id"]
-        with col:
-            st.markdown(f"- {name}")
-            if st.button("削除", key=f"remove_{participant_id}"):
-                remove_participant(conn, participant_id)
-                refresh_data(conn)
+            with db.writer() as conn:
+                success, error_msg = add_participant(conn, st.session_state.event_id, name)
+            if success:
+                refresh_data(db)
+                flash("participants", f"{name} を追加しました。")
                 trigger_rerun()
-else:
-    st.info("参加者を追加するとここに表示されます。")
-
-st.subheader("注文の入力")
-if not st.session_state.participants:
-    st.warning("先に参加者を追加してください。")
-else:
-    initialize_order_state()
-
-    input_mode = st.radio(
-        "ドリンクの選択方法",
-        ("メニューから選ぶ", "自由入力"),
-        horizontal=True,
-        key="order_input_mode",
-    )
+            else:
+                st.warning(error_msg or "参加者の追加に失敗しました。")
+
+    participants_data = st.session_state.participants
+    if participants_data:
+        cols = st.columns(3)
+        for idx, participant in enumerate(participants_data):
+            col = cols[idx % len(cols)]
+            name = participant["name"]
+            participant_id = participant["id"]
+            with col:
+                st.markdown(f"- {name}")
+                if st.button("削除", key=f"remove_{participant_id}"):
+                    with db.writer() as conn:
+                        removed, error_msg = remove_participant(
+                            conn, st.session_state.event_id, participant_id
+                        )
+                    if removed:
+                        refresh_data(db)
+                        trigger_rerun()
+                    else:
+                        st.warning(error_msg)
+
+        with st.expander("まとめて削除", expanded=False):
+            participant_ids_by_name = {p["name"]: p["id"] for p in participants_data}
+            names_to_remove = st.multiselect(
+                "削除する参加者", list(participant_ids_by_name), key="bulk_remove_names"
+            )
+            if st.button("選択した参加者を削除", disabled=not names_to_remove):
+                with db.writer() as conn:
+                    removed, error_msg = remove_participants(
+                        conn,
+                        st.session_state.event_id,
+                        [participant_ids_by_name[name] for name in names_to_remove],
+                    )
+                if removed:
+                    refresh_data(db)
+                    trigger_rerun()
+                else:
+                    st.warning(error_msg)
+    else:
+        st.info("参加者を追加するとここに表示されます。")
+
+
+def undo_order_action(db: Database, event_id: int, seq: int, label: str) -> None:
+    with db.writer() as conn:
+        ok, error_msg = undo_last_order_action(conn, event_id, seq)
+    refresh_data(db)
+    if ok:
+        flash("order_entry", f"{label}を元に戻しました。")
+    else:
+        flash("order_entry", error_msg, level="warning")
 
-    category_for_order = "自由入力"
 
-    if input_mode == "メニューから選ぶ" and MENU_DATA:
-        category_options = list(MENU_DATA.keys())
-        if st.session_state.order_category not in category_options:
-            st.session_state.order_category = category_options[0]
+def get_order_cart() -> list[dict]:
+    """Staged order lines of the current event, kept per session."""
+    carts = st.session_state.setdefault("order_carts", {})
+    return carts.setdefault(st.session_state.event_id, [])
 
-        selected_category = st.selectbox(
-            "カテゴリー",
-            category_options,
-            key="order_category",
+
+def render_order_cart(db: Database) -> None:
+    cart = get_order_cart()
+    if not cart:
+        return
+    import pandas as pd
+
+    names_by_id = {p["id"]: p["name"] for p in st.session_state.participants}
+    cart_total = sum(line["unit_price"] * line["quantity"] for line in cart)
+    st.markdown(f"**カート: {len(cart)}件 / 合計 {cart_total:,.0f}円**")
+    st.dataframe(
+        pd.DataFrame(
+            {
+                "ドリンク": [line["drink_name"] for line in cart],
+                "単価": [line["unit_price"] for line in cart],
+                "杯数": [line["quantity"] for line in cart],
+                "金額": [line["unit_price"] * line["quantity"] for line in cart],
+                "割り勘": [
+                    ", ".join(names_by_id.get(pid, "(削除済み)") for pid in line["participant_ids"])
+                    for line in cart
+                ],
+                "支払者": [names_by_id.get(line["payer_id"], "") for line in cart],
+                "メモ": [line["memo"] for line in cart],
+            }
+        ),
+        hide_index=True,
+        use_container_width=True,
+    )
+    cart_cols = st.columns(3)
+    commit_cart = cart_cols[0].button("カートをまとめて記録", type="primary")
+    cart_cols[1].button("最後の行を取り消す", on_click=cart.pop)
+    cart_cols[2].button("カートを空にする", on_click=cart.clear)
+
+    if commit_cart:
+        # One transaction and one refresh for the whole round.
+        with db.writer() as conn:
+            recorded, error = add_orders(conn, st.session_state.event_id, cart)
+        if error:
+            st.error(error)
+        else:
+            cart.clear()
+            refresh_data(db)
+            flash("order_entry", f"カートの{recorded}件の注文を記録しました。")
+            trigger_rerun()
+
+
+@as_fragment
+def render_order_entry(db: Database, menu: Menu) -> None:
+    st.subheader("注文の入力")
+    show_flash("order_entry")
+    participants_data = st.session_state.participants
+    if not participants_data:
+        st.warning("先に参加者を追加してください。")
+    else:
+        initialize_order_state()
+
+        input_mode = st.radio(
+            "ドリンクの選択方法",
+            ("メニューから選ぶ", "自由入力"),
+            horizontal=True,
+            key="order_input_mode",
         )
 
-        menu_items = MENU_DATA.get(selected_category, [])
-        if menu_items:
-            if st.session_state.order_menu_index >= len(menu_items):
-                st.session_state.order_menu_index = 0
+        category_for_order = "自由入力"
 
-            menu_labels = [
-                f"{name} ({f'{price:,}円' if price is not None else '価格未設定'})"
-                for name, price in menu_items
-            ]
-            st.selectbox(
-                "ドリンク",
-                list(range(len(menu_items))),
-                key="order_menu_index",
-                format_func=lambda idx: menu_labels[idx],
-            )
+        if input_mode == "メニューから選ぶ" and MENU_DATA:
+            category_options = list(MENU_DATA.keys())
+            if st.session_state.order_category not in category_options:
+                st.session_state.order_category = category_options[0]
 
-            selected_index = st.session_state.order_menu_index
-            drink_name, base_price = menu_items[selected_index]
-            st.session_state.order_drink_name = drink_name
+            selected_category = st.selectbox(
+                "カテゴリー",
+                category_options,
+                key="order_category",
+            )
 
-            current_selection = (selected_category, selected_index)
-            if st.session_state._last_menu_selection != current_selection:
-                st.session_state._last_menu_selection = current_selection
-                st.session_state.order_unit_price = (
-                    float(base_price) if base_price is not None else 0.0
+            menu_items = MENU_DATA.get(selected_category, [])
+            if menu_items:
+                if st.session_state.order_menu_index >= len(menu_items):
+                    st.session_state.order_menu_index = 0
+
+                menu_labels = [
+                    f"{name} ({f'{price:,}円' if price is not None else '価格未設定'})"
+                    for name, price in menu_items
+                ]
+                st.selectbox(
+                    "ドリンク",
+                    list(range(len(menu_items))),
+                    key="order_menu_index",
+                    format_func=lambda idx: menu_labels[idx],
                 )
 
+                selected_index = st.session_state.order_menu_index
+                drink_name, base_price = menu_items[selected_index]
+                st.session_state.order_drink_name = drink_name
+
+                current_selection = (selected_category, selected_index)
+                if st.session_state._last_menu_selection != current_selection:
+                    st.session_state._last_menu_selection = current_selection
+                    st.session_state.order_unit_price = (
+                        float(base_price) if base_price is not None else 0.0
+                    )
+
+                st.number_input(
+                    "単価 (円)",
+                    min_value=0.0,
+                    step=10.0,
+                    key="order_unit_price",
+                    help="価格は必要に応じて調整できます。",
+                )
+                if base_price is None:
+                    st.info("このメニューは価格が未設定です。適切な単価を入力してください。")
+
+                category_for_order = selected_category
+            else:
+                st.warning("このカテゴリーにはメニューがありません。手入力で登録してください。")
+                st.session_state.order_drink_name = ""
+                st.session_state.order_unit_price = 0.0
+                st.number_input(
+                    "単価 (円)",
+                    min_value=0.0,
+                    step=10.0,
+                    key="order_unit_price",
+                )
+        else:
+            if input_mode == "メニューから選ぶ" and not MENU_DATA:
+                st.info("メニューが登録されていません。自由入力をご利用ください。")
+            st.text_input("ドリンク名", max_chars=50, key="order_drink_name")
             st.number_input(
                 "単価 (円)",
                 min_value=0.0,
                 step=10.0,
                 key="order_unit_price",
-                help="価格は必要に応じて調整できます。",
             )
-            if base_price is None:
-                st.info("このメニューは価格が未設定です。適切な単価を入力してください。")
+            category_for_order = "自由入力"
+
+        st.number_input("杯数", min_value=1, step=1, key="order_quantity")
+        participant_names = [participant["name"] for participant in participants_data]
+        st.multiselect(
+            "割り勘する参加者",
+            participant_names,
+            key="order_share_with",
+        )
+        payer_names = {p["id"]: p["name"] for p in participants_data}
+        st.selectbox(
+            "支払った人",
+            [None, *payer_names],
+            format_func=lambda pid: "未設定" if pid is None else payer_names[pid],
+            key="order_payer",
+            help="会計を立て替えた人を記録すると、精算の送金リストを計算します。",
+        )
+        st.text_input("メモ (任意)", max_chars=60, key="order_memo")
+
+        button_cols = st.columns(2)
+        submitted = button_cols[0].button("注文を記録", type="primary")
+        add_to_cart = button_cols[1].button(
+            "カートに追加", help="複数の注文をまとめてから一度に記録します。"
+        )
+
+        if submitted or add_to_cart:
+            drink_name_value = st.session_state.order_drink_name.strip()
+            unit_price_value = float(st.session_state.order_unit_price)
+            quantity_value = int(st.session_state.order_quantity)
+            share_with_value = st.session_state.order_share_with
+            memo_value = st.session_state.order_memo.strip()
+            mode_label = "メニュー" if input_mode == "メニューから選ぶ" else "自由入力"
+
+            if not drink_name_value:
+                st.warning("ドリンク名を入力または選択してください。")
+            elif unit_price_value <= 0:
+                st.warning("単価は0より大きい値にしてください。")
+            elif not share_with_value:
+                st.warning("割り勘する参加者を選択してください。")
+            else:
+                name_to_id = {p["name"]: p["id"] for p in participants_data}
+                try:
+                    participant_ids = [name_to_id[name] for name in share_with_value]
+                except KeyError:
+                    st.error("参加者の取得に失敗しました。ページを更新してください。")
+                    participant_ids = []
+
+                if participant_ids:
+                    order_line = {
+                        "drink_name": drink_name_value,
+                        "unit_price": unit_price_value,
+                        "quantity": quantity_value,
+                        "memo": memo_value,
+                        "category": category_for_order,
+                        "input_mode": mode_label,
+                        "participant_ids": participant_ids,
+                        "payer_id": st.session_state.order_payer,
+                    }
+                    if add_to_cart:
+                        get_order_cart().append(order_line)
+                        recorded, error_msg = True, None
+                        message = f"{drink_name_value} をカートに追加しました。"
+                    else:
+                        with db.writer() as conn:
+                            recorded, error_msg = add_order(
+                                conn, event_id=st.session_state.event_id, **order_line
+                            )
+                        message = f"{drink_name_value} を記録しました。"
+                    if recorded:
+                        if not add_to_cart:
+                            refresh_data(db)
+                        reset_order_inputs(input_mode)
+                        flash("order_entry", message)
+                        trigger_rerun()
+                    else:
+                        st.error(error_msg)
+
+        render_order_cart(db)
+
+        last_action = st.session_state.last_order_action
+        if last_action:
+            # The callback gets the entry drawn on the button; by the time
+            # the click's rerun reaches this line the snapshot may have moved.
+            st.button(
+                f"元に戻す: {last_action[1]}",
+                key="order_undo",
+                on_click=undo_order_action,
+                args=(db, st.session_state.event_id, *last_action),
+            )
 
-            category_for_order = selected_category
-        else:
-            st.warning("このカテゴリーにはメニューがありません。手入力で登録してください。")
-            st.session_state.order_drink_name = ""
-            st.session_state.order_unit_price = 0.0
-            st.number_input(
-                "単価 (円)",
-                min_value=0.0,
-                step=10.0,
-                key="order_unit_price",
+        with st.expander("CSVから一括取り込み", expanded=False):
+            st.caption(
+                "列: ドリンク, 数量, 単価, 割り勘する人 (/区切り、空欄で全員), メモ, 支払者。"
+                "メニューにあるドリンクは単価を省略できます。"
             )
-    else:
-        if input_mode == "メニューから選ぶ" and not MENU_DATA:
-            st.info("メニューが登録されていません。自由入力をご利用ください。")
-        st.text_input("ドリンク名", max_chars=50, key="order_drink_name")
-        st.number_input(
-            "単価 (円)",
-            min_value=0.0,
-            step=10.0,
-            key="order_unit_price",
+            uploaded_orders = st.file_uploader("注文CSV", type="csv", key="order_import_file")
+            if uploaded_orders is not None and st.button("CSVの注文を取り込む"):
+                raw = uploaded_orders.getvalue()
+                try:
+                    csv_text = raw.decode("utf-8-sig")
+                except UnicodeDecodeError:
+                    # Receipt exports from Japanese POS systems are often Shift_JIS.
+                    csv_text = raw.decode("cp932", errors="replace")
+                started = time.perf_counter()
+                with db.writer() as conn:
+                    imported, import_errors = import_orders(
+                        conn, st.session_state.event_id, parse_order_csv(csv_text), menu
+                    )
+                elapsed = time.perf_counter() - started
+                if import_errors:
+                    error_lines = "\n".join(f"- {message}" for message in import_errors[:20])
+                    st.error(f"取り込みを中止しました。\n\n{error_lines}")
+                elif not imported:
+                    st.warning("取り込める注文がありませんでした。")
+                else:
+                    refresh_data(db)
+                    flash(
+                        "order_entry",
+                        f"{imported:,}件の注文を取り込みました "
+                        f"({elapsed:.2f}秒, {imported / max(elapsed, 1e-9):,.0f}件/秒)。",
+                    )
+                    trigger_rerun()
+
+
+def render_order_editor(db: Database, page_orders: list[dict], page_offset: int) -> None:
+    participant_names_by_id = {p["id"]: p["name"] for p in st.session_state.participants}
+    with st.expander("注文の修正・取り消し", expanded=False):
+        order_index = st.selectbox(
+            "対象の注文",
+            list(range(len(page_orders))),
+            format_func=lambda idx: (
+                f"#{page_offset + idx + 1} {page_orders[idx]['drink_name']}"
+                f" ({page_orders[idx]['quantity']}杯, {', '.join(page_orders[idx]['share_with'])})"
+            ),
+            key="order_edit_index",
         )
-        category_for_order = "自由入力"
+        order = page_orders[min(order_index, len(page_orders) - 1)]
+        # Unkeyed widgets: picking another order starts from its own values.
+        with st.form("order_edit_form"):
+            unit_price = st.number_input(
+                "単価 (円)", min_value=0.0, step=10.0, value=float(order["unit_price"])
+            )
+            quantity = st.number_input("杯数", min_value=1, step=1, value=order["quantity"])
+            sharer_ids = st.multiselect(
+                "割り勘する参加者",
+                list(participant_names_by_id),
+                default=[pid for pid in order["share_with_ids"] if pid in participant_names_by_id],
+                format_func=participant_names_by_id.get,
+            )
+            payer_options = [None, *participant_names_by_id]
+            payer_id = st.selectbox(
+                "支払った人",
+                payer_options,
+                index=payer_options.index(order["payer_id"])
+                if order["payer_id"] in payer_options
+                else 0,
+                format_func=lambda pid: "未設定" if pid is None else participant_names_by_id[pid],
+            )
+            memo = st.text_input("メモ (任意)", value=order["memo"], max_chars=60)
+            save_submitted = st.form_submit_button("修正を保存")
+        void_clicked = st.button("この注文を取り消す")
+
+        if save_submitted or void_clicked:
+            with db.writer() as conn:
+                if save_submitted:
+                    ok, error_msg = amend_order(
+                        conn,
+                        st.session_state.event_id,
+                        order["id"],
+                        unit_price=float(unit_price),
+                        quantity=int(quantity),
+                        participant_ids=sharer_ids,
+                        payer_id=payer_id,
+                        memo=memo.strip(),
+                    )
+                    message = f"{order['drink_name']} を修正しました。"
+                else:
+                    ok, error_msg = void_order(conn, st.session_state.event_id, order["id"])
+                    message = f"{order['drink_name']} を取り消しました。"
+            if ok:
+                refresh_data(db)
+                flash("order_list", message)
+                trigger_rerun()
+            else:
+                st.warning(error_msg)
 
-    st.number_input("杯数", min_value=1, step=1, key="order_quantity")
-    participant_names = [participant["name"] for participant in participants_data]
-    st.multiselect(
-        "割り勘する参加者",
-        participant_names,
-        key="order_share_with",
-    )
-    st.text_input("メモ (任意)", max_chars=60, key="order_memo")
-
-    submitted = st.button("注文を記録", type="primary")
-
-    if submitted:
-        drink_name_value = st.session_state.order_drink_name.strip()
-        unit_price_value = float(st.session_state.order_unit_price)
-        quantity_value = int(st.session_state.order_quantity)
-        share_with_value = st.session_state.order_share_with
-        memo_value = st.session_state.order_memo.strip()
-        mode_label = "メニュー" if input_mode == "メニューから選ぶ" else "自由入力"
-
-        if not drink_name_value:
-            st.warning("ドリンク名を入力または選択してください。")
-        elif unit_price_value <= 0:
-            st.warning("単価は0より大きい値にしてください。")
-        elif not share_with_value:
-            st.warning("割り勘する参加者を選択してください。")
-        else:
-            name_to_id = {p["name"]: p["id"] for p in participants_data}
-            try:
-                participant_ids = [name_to_id[name] for name in share_with_value]
-            except KeyError:
-                st.error("参加者の取得に失敗しました。ページを更新してください。")
-                participant_ids = []
-
-            if participant_ids:
-                add_order(
-                    conn,
-                    drink_name=drink_name_value,
-                    unit_price=unit_price_value,
-                    quantity=quantity_value,
-                    memo=memo_value,
-                    category=category_for_order,
-                    input_mode=mode_label,
-                    participant_ids=participant_ids,
-                )
-                refresh_data(conn)
-                reset_order_inputs(input_mode)
-                st.success(f"{drink_name_value} を記録しました。")
 
-if st.session_state.orders:
+@as_fragment
+def render_order_list(db: Database) -> None:
     st.subheader("注文一覧")
-    order_rows = []
-    for idx, order in enumerate(st.session_state.orders, start=1):
-        total_price = order["unit_price"] * order["quantity"]
-        order_rows.append(
-            {
-                "#": idx,
-                "カテゴリー": order.get("category", ""),
-                "ドリンク": order["drink_name"],
-                "単価": order["unit_price"],
-                "数量": order["quantity"],
-                "合計金額": total_price,
-                "人数": len(order["share_with"]),
-                "割り勘する人": ", ".join(order["share_with"]),
-                "メモ": order["memo"],
-            }
-        )
+    show_flash("order_list")
+    participants_data = st.session_state.participants
+    participant_names_by_id = {p["id"]: p["name"] for p in participants_data}
+    filter_cols = st.columns(3)
+    participant_filter = filter_cols[0].selectbox(
+        "参加者で絞り込み",
+        [None, *participant_names_by_id],
+        format_func=lambda pid: "すべて" if pid is None else participant_names_by_id[pid],
+        key="order_filter_participant",
+    )
+    category_filter = filter_cols[1].selectbox(
+        "カテゴリーで絞り込み",
+        [None, *st.session_state.order_summary["categories"]],
+        format_func=lambda category: "すべて" if category is None else category,
+        key="order_filter_category",
+    )
+    drink_filter = filter_cols[2].text_input(
+        "ドリンク名で絞り込み", key="order_filter_drink"
+    ).strip()
+
+    # Each entry is the keyset cursor a page starts after; the last one is shown.
+    page_filters = (
+        st.session_state.event_id,
+        participant_filter,
+        category_filter,
+        drink_filter,
+    )
+    if st.session_state.get("_order_page_filters") != page_filters:
+        st.session_state._order_page_filters = page_filters
+        st.session_state.order_page_cursors = [None]
+    page_cursors = st.session_state.order_page_cursors
+
+    page_orders = load_order_page(
+        db,
+        db.path,
+        st.session_state.event_id,
+        st.session_state.data_version,
+        page_cursors[-1],
+        participant_filter,
+        category_filter,
+        drink_filter,
+    )
+    has_next_page = len(page_orders) > ORDER_PAGE_SIZE
+    page_orders = page_orders[:ORDER_PAGE_SIZE]
+    page_offset = (len(page_cursors) - 1) * ORDER_PAGE_SIZE
+
+    if page_orders:
+        order_rows = []
+        for idx, order in enumerate(page_orders, start=page_offset + 1):
+            total_price = order["unit_price"] * order["quantity"]
+            order_rows.append(
+                {
+                    "#": idx,
+                    "カテゴリー": order.get("category", ""),
+                    "ドリンク": order["drink_name"],
+                    "単価": order["unit_price"],
+                    "数量": order["quantity"],
+                    "合計金額": total_price,
+                    "人数": len(order["share_with"]),
+                    "割り勘する人": ", ".join(order["share_with"]),
+                    "支払者": participant_names_by_id.get(order["payer_id"], ""),
+                    "メモ": order["memo"],
+                }
+            )
 
-    order_df = pd.DataFrame(order_rows)
-    st.dataframe(order_df, use_container_width=True)
+        import pandas as pd
 
-    st.subheader("金額集計")
-    totals = {participant["name"]: 0.0 for participant in st.session_state.participants}
-    for order in st.session_state.orders:
-        total_price = order["unit_price"] * order["quantity"]
-        if order["share_with"]:
-            share = total_price / len(order["share_with"])
-            for name in order["share_with"]:
-                if name in totals:
-                    totals[name] += share
-
-    total_sum = sum(totals.values())
-    totals_df = pd.DataFrame(
+        order_df = pd.DataFrame(order_rows)
+        st.dataframe(order_df, use_container_width=True)
+    else:
+        st.info("条件に合う注文はありません。")
+
+    if page_orders:
+        render_order_editor(db, page_orders, page_offset)
+
+    last_order = page_orders[-1] if page_orders else None
+    nav_cols = st.columns(3)
+    nav_cols[0].button(
+        "前へ",
+        key="order_page_prev",
+        disabled=len(page_cursors) == 1,
+        on_click=page_cursors.pop,
+    )
+    nav_cols[1].caption(
+        f"{page_offset + 1 if page_orders else 0}〜{page_offset + len(page_orders)}件目"
+        f" (全体 {st.session_state.order_summary['count']}件)"
+    )
+    nav_cols[2].button(
+        "次へ",
+        key="order_page_next",
+        disabled=not has_next_page,
+        on_click=lambda: page_cursors.append(
+            (last_order["created_at"], last_order["id"])
+        ),
+    )
+
+
+def ledger_export(db: Database, event_id: int, fmt: str) -> Callable[[], bytes]:
+    """Build the full-ledger file only when the download is requested.
+
+    The file is returned as bytes: Streamlit reads whatever the callable
+    returns into memory anyway, so only the export itself is streamed.
+    """
+
+    def build() -> bytes:
+        sink = io.BytesIO()
+        with db.reader() as conn:
+            if fmt == "parquet":
+                write_ledger_parquet(conn, event_id, sink)
+            else:
+                write_ledger_csv(conn, event_id, sink)
+        return sink.getvalue()
+
+    return build
+
+
+def render_transfers() -> None:
+    import pandas as pd
+
+    st.markdown("**精算の送金リスト**")
+    unpaid = st.session_state.unpaid_orders
+    if unpaid["count"] == st.session_state.order_summary["count"]:
+        st.caption("注文に支払った人を記録すると、誰が誰にいくら送ればよいかを表示します。")
+        return
+    if unpaid["count"]:
+        st.caption(
+            f"支払った人が未設定の注文 {unpaid['count']}件 ({unpaid['amount']:,.0f}円) は"
+            "送金リストに含まれていません。"
+        )
+    transfers = st.session_state.transfers
+    if not transfers:
+        st.success("送金は必要ありません。")
+        return
+    transfers_df = pd.DataFrame(
         {
-            "参加者": list(totals.keys()),
-            "支払い額": [round(amount, 2) for amount in totals.values()],
+            "送る人": [transfer["from"] for transfer in transfers],
+            "受け取る人": [transfer["to"] for transfer in transfers],
+            "金額": [transfer["amount"] for transfer in transfers],
         }
     )
-    totals_df.sort_values("支払い額", ascending=False, inplace=True)
-    st.metric("合計金額 (円)", f"{total_sum:,.0f}")
-    st.dataframe(totals_df, use_container_width=True)
+    st.dataframe(transfers_df, hide_index=True, use_container_width=True)
+    st.download_button(
+        "送金リストをCSVでダウンロード",
+        data=lambda: transfers_df.to_csv(index=False).encode("utf-8-sig"),
+        file_name=f"drink_transfers_{st.session_state.event_id}.csv",
+        mime="text/csv",
+    )
+
+
+@as_fragment
+def render_settlement(db: Database) -> None:
+    import pandas as pd
+
+    st.subheader("金額集計")
+    with profile_phase("totals"):
+        balances = st.session_state.balances
+        amounts = np.array([balance["amount"] for balance in balances], dtype=np.float64)
+        total_sum = round(amounts.sum())
+        totals_df = pd.DataFrame(
+            {
+                "参加者": [balance["name"] for balance in balances],
+                "支払い額": allocate_yen(amounts, total_sum),
+            }
+        )
+        totals_df.sort_values("支払い額", ascending=False, inplace=True)
+        st.metric("合計金額 (円)", f"{total_sum:,.0f}")
+        st.dataframe(totals_df, use_container_width=True)
+
+    with profile_phase("chart"):
+        chart_df = totals_df.set_index("参加者")
+        st.bar_chart(chart_df)
+
+    with profile_phase("transfers"):
+        render_transfers()
+
+    with profile_phase("csv"):
+        event_id = st.session_state.event_id
+        download_cols = st.columns(3)
+        download_cols[0].download_button(
+            "集計結果をCSVでダウンロード",
+            data=lambda: totals_df.to_csv(index=False).encode("utf-8-sig"),
+            file_name="drink_totals.csv",
+            mime="text/csv",
+        )
+        download_cols[1].download_button(
+            "全注文の明細をCSVでダウンロード",
+            data=ledger_export(db, event_id, "csv"),
+            file_name=f"drink_ledger_{event_id}.csv",
+            mime="text/csv",
+        )
+        if PARQUET_AVAILABLE:
+            download_cols[2].download_button(
+                "全注文の明細をParquetでダウンロード",
+                data=ledger_export(db, event_id, "parquet"),
+                file_name=f"drink_ledger_{event_id}.parquet",
+                mime="application/vnd.apache.parquet",
+            )
 
-    chart_df = totals_df.set_index("参加者")
-    st.bar_chart(chart_df)
 
+@as_fragment
+def render_reports(db: Database) -> None:
+    with st.expander("レポート", expanded=False):
+        if not st.checkbox("レポートを表示", key="report_enabled"):
+            return
+        scope = st.radio(
+            "対象", ("このイベント", "全イベント"), horizontal=True, key="report_scope"
+        )
+        event_id = st.session_state.event_id if scope == "このイベント" else None
+        reports = load_reports(db, db.path, db.data_version(), event_id)
+        drink_tab, category_tab, hour_tab, person_tab = st.tabs(
+            ["ドリンク別", "カテゴリー別", "時間帯別", "参加者別"]
+        )
+        report_columns = {
+            "drink_name": "ドリンク",
+            "category": "カテゴリー",
+            "hour": "時間帯",
+            "name": "参加者",
+            "events": "イベント数",
+            "orders": "注文数",
+            "cups": "杯数",
+            "amount": "金額",
+        }
+        for tab, key in (
+            (drink_tab, "drinks"),
+            (category_tab, "categories"),
+            (hour_tab, "hours"),
+            (person_tab, "people"),
+        ):
+            report = reports[key].rename(columns=report_columns)
+            if key == "people":
+                report["金額"] = report["金額"].round()
+            tab.dataframe(report, hide_index=True, use_container_width=True)
+        if not reports["hours"].empty:
+            hour_tab.bar_chart(reports["hours"].set_index("hour")["cups"])
+
+
+def render_closed_event(db: Database) -> None:
+    st.info("このイベントは終了しました。注文の明細はアーカイブに移されています。")
+    st.subheader("最終的な支払い額")
+    totals = load_final_totals(db, db.path, st.session_state.event_id)
+    totals_df = (
+        totals[["name", "yen"]]
+        .rename(columns={"name": "参加者", "yen": "支払い額"})
+        .sort_values("支払い額", ascending=False)
+    )
+    st.metric("合計金額 (円)", f"{int(totals_df['支払い額'].sum()):,}")
+    st.dataframe(totals_df, hide_index=True, use_container_width=True)
     st.download_button(
         "集計結果をCSVでダウンロード",
-        data=totals_df.to_csv(index=False).encode("utf-8-sig"),
+        data=lambda: totals_df.to_csv(index=False).encode("utf-8-sig"),
         file_name="drink_totals.csv",
         mime="text/csv",
     )
-else:
-    st.info("注文が登録されると、ここに一覧と集計が表示されます。")
+
+
+def render_profile_panel(profiler: RerunProfiler, container=None) -> None:
+    import pandas as pd
+
+    summary = profiler.summary()
+    if container is None:
+        container = st.sidebar.expander("デバッグ: 処理時間", expanded=True)
+    with container:
+        cols = st.columns(3)
+        cols[0].metric("全体 (ms)", f"{summary['total_ms']:.1f}")
+        cols[1].metric("SQL (ms)", f"{summary['sql_ms']:.1f}")
+        cols[2].metric("SQL文", summary["sql_count"])
+        st.dataframe(
+            pd.DataFrame(
+                {
+                    "処理": list(summary["phases_ms"]),
+                    "ms": [round(ms, 2) for ms in summary["phases_ms"].values()],
+                }
+            ),
+            hide_index=True,
+            use_container_width=True,
+        )
+        if summary["statements"]:
+            st.dataframe(
+                pd.DataFrame(summary["statements"])[
+                    ["duration_ms", "vm_steps", "sql"]
+                ].sort_values("duration_ms", ascending=False),
+                hide_index=True,
+                use_container_width=True,
+            )
+
+
+def log_profile(profiler: RerunProfiler, **extra: object) -> None:
+    if os.environ.get("ALCAL_PROFILE_LOG"):
+        profiler.write_jsonl(
+            os.environ["ALCAL_PROFILE_LOG"], event_id=st.session_state.get("event_id"), **extra
+        )
+
+
+st.set_page_config(page_title="飲み会ドリンク計算", layout="wide")
+
+profiler = RerunProfiler() if profiling_requested() else None
+with profiler.activate() if profiler else nullcontext():
+    menus, menu_errors = load_menus(MENU_DIR)
+    for menu_error in menu_errors:
+        st.warning(f"メニューファイルを読み込めませんでした: {menu_error}")
+    if st.session_state.get("shop") not in menus:
+        st.session_state.shop = next(iter(menus), None)
+    menu = menus.get(st.session_state.shop) or Menu({})
+    MENU_DATA = menu.categories
+    ALL_MENU_ITEMS = menu.items
+
+    with profile_phase("get_database"):
+        db = get_database(str(DB_PATH))
+
+    events = load_events(db, db.path, db.data_version())
+    event_ids = [event["id"] for event in events]
+    if "event_id" not in st.session_state:
+        requested_event = st.query_params.get("event")
+        st.session_state.event_id = (
+            int(requested_event)
+            if requested_event and requested_event.isdigit()
+            and int(requested_event) in event_ids
+            else DEFAULT_EVENT_ID
+        )
+    if "_pending_event_id" in st.session_state:
+        st.session_state.event_id = st.session_state.pop("_pending_event_id")
+    st.query_params["event"] = str(st.session_state.event_id)
+    event_closed = any(
+        event["id"] == st.session_state.event_id and event["closed_at"] for event in events
+    )
+    with profile_phase("refresh_data"):
+        refresh_data(db)
+
+    st.title("飲み放題じゃない時のドリンク割り勘ツール")
+    st.caption("参加者と注文を追加すると自動で金額を集計します。")
+
+    if ALL_MENU_ITEMS:
+        render_menu(menu)
+
+    with st.sidebar:
+        if len(menus) > 1:
+            st.header("お店")
+            st.selectbox(
+                "メニューを使うお店", list(menus), key="shop", on_change=reset_menu_selection
+            )
+
+        st.header("イベント")
+        event_names = {
+            event["id"]: event["name"] + (" (終了)" if event["closed_at"] else "")
+            for event in events
+        }
+        st.selectbox(
+            "表示するイベント",
+            event_ids,
+            key="event_id",
+            format_func=lambda event_id: event_names.get(event_id, str(event_id)),
+        )
+        with st.form("create_event", clear_on_submit=True):
+            new_event = st.text_input("新しいイベント名", max_chars=30)
+            create_event_submitted = st.form_submit_button("イベントを作成")
+        if create_event_submitted:
+            event_name = new_event.strip()
+            if not event_name:
+                st.warning("イベント名を入力してください。")
+            else:
+                with db.writer() as conn:
+                    new_event_id, error_msg = create_event(conn, event_name)
+                if new_event_id is None:
+                    st.warning(error_msg or "イベントの作成に失敗しました。")
+                else:
+                    # The selector is already rendered, so switch on the next run.
+                    st.session_state._pending_event_id = new_event_id
+                    trigger_rerun()
+
+        if not event_closed:
+            st.header("イベントの終了")
+            confirm_close = st.checkbox(
+                "これ以上注文を追加しないことを確認しました", key="close_event_confirm"
+            )
+            if st.button("イベントを終了してアーカイブ", disabled=not confirm_close):
+                with db.writer() as conn:
+                    closed, error_msg = close_event(conn, st.session_state.event_id, ARCHIVE_PATH)
+                if closed:
+                    trigger_rerun()
+                else:
+                    st.warning(error_msg or "イベントの終了に失敗しました。")
+
+            st.header("リセット")
+            if st.button("このイベントの入力をクリア", type="primary"):
+                with db.writer() as conn:
+                    clear_event(conn, st.session_state.event_id)
+                refresh_data(db)
+                reset_order_inputs(st.session_state.get("order_input_mode", "自由入力"))
+                st.success("データをリセットしました。")
+
+    if event_closed:
+        render_closed_event(db)
+    else:
+        render_participants(db)
+        render_order_entry(db, menu)
+
+        if st.session_state.order_summary["count"]:
+            with profile_phase("order_table"):
+                render_order_list(db)
+            render_settlement(db)
+        else:
+            st.info("注文が登録されると、ここに一覧と集計が表示されます。")
+
+    with profile_phase("reports"):
+        render_reports(db)
+
+    if profiler is not None:
+        render_profile_panel(profiler)
+        log_profile(profiler)
+
+    # Last on the page: its poll may rerun the app, which must not cut a full
+    # run short before the sections above have handled their button clicks.
+    with st.sidebar:
+        if st.checkbox("他の端末の変更を自動で反映", value=True, key="auto_refresh"):
+            render_live_sync(db)
@@ -0,0 +1 @@
+"""Reproducible benchmarks of the alcal hot paths on synthetic parties."""
@@ -0,0 +1,169 @@
+"""Simulate concurrent guests against one in-process copy of the app.
+
+    python -m benchmarks.load                          # 1, 2, 4 and 8 sessions
+    python -m benchmarks.load --sessions 16 --actions 30
+    python -m benchmarks.load --output load.json
+
+Every session is a Streamlit ``AppTest`` in its own worker process (AppTest
+keeps global runtime state, so several cannot run in one process). The
+sessions therefore contend for SQLite's file lock instead of queueing on
+one in-process writer, which makes this a pessimistic bound for a single
+``streamlit run``. Each level starts from an empty temporary
+``drink_orders.db``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import random
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from streamlit.testing.v1 import AppTest
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+APP_FILES = ("app.py", "alcal", "menus")
+RERUN_TIMEOUT_SECONDS = 120
+
+
+def _copy_app(workdir: Path) -> Path:
+    """Copy the app next to a fresh database; DB_PATH is relative to app.py."""
+    for name in APP_FILES:
+        source = REPO_ROOT / name
+        if source.is_dir():
+            shutil.copytree(source, workdir / name, ignore=shutil.ignore_patterns("__pycache__"))
+        else:
+            shutil.copy(source, workdir / name)
+    return workdir / "app.py"
+
+
+def _rerun(at: AppTest, stats: dict) -> None:
+    """Run the script once, recording its latency and any exception."""
+    started = time.perf_counter()
+    at.run()
+    stats["latencies"].append(time.perf_counter() - started)
+    messages = [str(exception.value) for exception in at.exception]
+    if any("locked" in message or "busy" in message for message in messages):
+        stats["lock_errors"] += 1
+    elif messages:
+        stats["errors"] += 1
+
+
+def _guest(script: Path, guest: int, actions: int, seed: int) -> dict:
+    logging.disable(logging.WARNING)
+    rng = random.Random(seed + guest)
+    stats = {"latencies": [], "lock_errors": 0, "errors": 0}
+    at = AppTest.from_file(str(script), default_timeout=RERUN_TIMEOUT_SECONDS)
+    _rerun(at, stats)
+    name = f"guest{guest:03d}"
+    next(t for t in at.text_input if t.label == "参加者名を入力").input(name)
+    next(b for b in at.button if b.label == "参加者を追加").click()
+    _rerun(at, stats)
+    at.radio(key="order_input_mode").set_value("自由入力")
+    _rerun(at, stats)
+    for action in range(actions):
+        others = [p["name"] for p in at.session_state["participants"] if p["name"] != name]
+        at.text_input(key="order_drink_name").input(f"drink{action % 7}")
+        at.number_input(key="order_unit_price").set_value(float(rng.choice((400, 550, 700))))
+        at.multiselect(key="order_share_with").set_value(
+            [name, *rng.sample(others, min(len(others), rng.randint(0, 3)))]
+        )
+        next(b for b in at.button if b.label == "注文を記録").click()
+        _rerun(at, stats)
+    return stats
+
+
+def _percentile(cut_points: list[float], pct: int) -> float:
+    return cut_points[pct - 1] * 1000 if cut_points else 0.0
+
+
+def run_level(sessions: int, actions: int, seed: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        script = _copy_app(Path(tmp))
+        latencies: list[float] = []
+        lock_errors = errors = failed_sessions = 0
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=sessions) as pool:
+            futures = [
+                pool.submit(_guest, script, guest, actions, seed) for guest in range(sessions)
+            ]
+            for future in futures:
+                if future.exception() is not None:
+                    failed_sessions += 1
+                    continue
+                stats = future.result()
+                latencies.extend(stats["latencies"])
+                lock_errors += stats["lock_errors"]
+                errors += stats["errors"]
+        elapsed = time.perf_counter() - started
+        conn = sqlite3.connect(Path(tmp) / "drink_orders.db")
+        try:
+            orders = conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+        finally:
+            conn.close()
+
+    cut_points = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else []
+    return {
+        "sessions": sessions,
+        "reruns": len(latencies),
+        "p50_ms": _percentile(cut_points, 50),
+        "p95_ms": _percentile(cut_points, 95),
+        "p99_ms": _percentile(cut_points, 99),
+        "lock_errors": lock_errors,
+        "errors": errors,
+        "failed_sessions": failed_sessions,
+        "orders": orders,
+        "expected_orders": sessions * actions,
+        "reruns_per_s": len(latencies) / elapsed,
+        "orders_per_s": orders / elapsed,
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="benchmarks.load", description=__doc__.splitlines()[0]
+    )
+    parser.add_argument(
+        "--sessions",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8],
+        help="concurrency levels to run, one after another",
+    )
+    parser.add_argument("--actions", type=int, default=10, help="orders per session")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    # Streamlit logs context and deprecation warnings on every AppTest rerun;
+    # they would drown the table.
+    logging.disable(logging.WARNING)
+    print(
+        f"{'sessions':>8} {'reruns':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+        f" {'locks':>6} {'errors':>6} {'orders':>9} {'reruns/s':>9} {'orders/s':>9}"
+    )
+    results = []
+    for sessions in args.sessions:
+        result = run_level(sessions, args.actions, args.seed)
+        results.append(result)
+        print(
+            f"{result['sessions']:>8} {result['reruns']:>7}"
+            f" {result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f}"
+            f" {result['lock_errors']:>6} {result['errors'] + result['failed_sessions']:>6}"
+            f" {result['orders']:>4}/{result['expected_orders']:<4}"
+            f" {result['reruns_per_s']:>9.1f} {result['orders_per_s']:>9.1f}"
+        )
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+    return 0 if all(r["failed_sessions"] == 0 for r in results) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,230 @@
+"""Time the hot paths on synthetic parties and compare against a baseline.
+
+    python -m benchmarks                      # run the default scenarios
+    python -m benchmarks --save-baseline      # store results as the baseline
+    python -m benchmarks --compare            # exit 1 on a regression
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Callable
+from pathlib import Path
+
+from alcal.columnar import fetch_order_table
+from alcal.export import write_ledger_csv
+from alcal.reports import drink_report, person_report
+from alcal.settlement import compute_settlement
+from alcal.storage import (
+    DEFAULT_EVENT_ID,
+    fetch_balances,
+    fetch_event_totals,
+    fetch_order_page,
+    fetch_orders,
+    fetch_participants,
+    fetch_share_rows,
+    fetch_transfers,
+    open_connection,
+    remove_participant,
+)
+from benchmarks.synthetic import PartySpec, generate_party
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baseline.json"
+SCENARIOS = {
+    "small": PartySpec("small", participants=20, orders=500, payers=5),
+    "medium": PartySpec("medium", participants=100, orders=5_000, payers=30),
+    "large": PartySpec("large", participants=300, orders=50_000, max_share=10, payers=300),
+}
+
+
+def _fetch_orders(conn: sqlite3.Connection) -> int:
+    return len(fetch_orders(conn, DEFAULT_EVENT_ID))
+
+
+def _fetch_order_table(conn: sqlite3.Connection) -> int:
+    return len(fetch_order_table(conn, DEFAULT_EVENT_ID))
+
+
+def _fetch_order_page(conn: sqlite3.Connection) -> int:
+    return len(fetch_order_page(conn, DEFAULT_EVENT_ID))
+
+
+def _compute_settlement(conn: sqlite3.Connection) -> int:
+    share_rows = fetch_share_rows(conn, DEFAULT_EVENT_ID)
+    participant_ids = [p["id"] for p in fetch_participants(conn, DEFAULT_EVENT_ID)]
+    compute_settlement(share_rows, participant_ids)
+    return len(share_rows)
+
+
+def _fetch_balances(conn: sqlite3.Connection) -> int:
+    return len(fetch_balances(conn, DEFAULT_EVENT_ID))
+
+
+def _remove_participant(conn: sqlite3.Connection) -> int:
+    participant_id = fetch_participants(conn, DEFAULT_EVENT_ID)[0]["id"]
+    remove_participant(conn, DEFAULT_EVENT_ID, participant_id)
+    return 1
+
+
+def _export_totals_csv(conn: sqlite3.Connection) -> int:
+    totals = fetch_event_totals(conn, DEFAULT_EVENT_ID)
+    totals.to_csv(index=False).encode("utf-8-sig")
+    return len(totals)
+
+
+def _export_ledger_csv(conn: sqlite3.Connection) -> int:
+    # Counted in bytes written rather than rows.
+    return write_ledger_csv(conn, DEFAULT_EVENT_ID, io.BytesIO())
+
+
+def _fetch_transfers(conn: sqlite3.Connection) -> int:
+    return len(fetch_transfers(conn, DEFAULT_EVENT_ID))
+
+
+def _reports(conn: sqlite3.Connection) -> int:
+    return len(drink_report(conn)) + len(person_report(conn))
+
+
+# name -> (function returning the number of items processed, mutates the database)
+BENCHMARKS: dict[str, tuple[Callable[[sqlite3.Connection], int], bool]] = {
+    "fetch_orders": (_fetch_orders, False),
+    "fetch_order_table": (_fetch_order_table, False),
+    "fetch_order_page": (_fetch_order_page, False),
+    "compute_settlement": (_compute_settlement, False),
+    "fetch_balances": (_fetch_balances, False),
+    "remove_participant": (_remove_participant, True),
+    "export_totals_csv": (_export_totals_csv, False),
+    "export_ledger_csv": (_export_ledger_csv, False),
+    "reports": (_reports, False),
+    "fetch_transfers": (_fetch_transfers, False),
+}
+
+
+def _measure(
+    func: Callable[[sqlite3.Connection], int],
+    source: Path,
+    workdir: Path,
+    mutates: bool,
+    repeat: int,
+) -> dict:
+    timings = []
+    items = 0
+    peak = 0
+    # The last round runs under tracemalloc; it is kept out of the timings.
+    for round_ in range(repeat + 1):
+        path = source
+        if mutates:
+            path = workdir / f"copy{round_}.db"
+            shutil.copyfile(source, path)
+        conn = open_connection(str(path))
+        try:
+            if round_ == repeat:
+                tracemalloc.start()
+                func(conn)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            else:
+                started = time.perf_counter()
+                items = func(conn)
+                timings.append(time.perf_counter() - started)
+        finally:
+            conn.close()
+    median = statistics.median(timings)
+    return {
+        "median_s": median,
+        "min_s": min(timings),
+        "items": items,
+        "items_per_s": items / median if median else 0.0,
+        "peak_mib": peak / 2**20,
+    }
+
+
+def run(scenarios: list[str], repeat: int) -> dict[str, dict]:
+    results: dict[str, dict] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        for scenario in scenarios:
+            spec = SCENARIOS[scenario]
+            source = workdir / f"{scenario}.db"
+            share_rows = generate_party(source, spec)
+            # Fold the WAL into the main file so copies are self-contained.
+            conn = sqlite3.connect(source)
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.close()
+            print(
+                f"[{scenario}] {spec.participants} participants, "
+                f"{spec.orders:,} orders, {share_rows:,} share rows"
+            )
+            for name, (func, mutates) in BENCHMARKS.items():
+                result = _measure(func, source, workdir, mutates, repeat)
+                results[f"{scenario}/{name}"] = result
+                print(
+                    f"  {name:<20} {result['median_s'] * 1000:9.2f} ms"
+                    f"  {result['items_per_s']:>12,.0f} items/s"
+                    f"  {result['peak_mib']:8.2f} MiB peak"
+                )
+    return results
+
+
+def compare(
+    results: dict[str, dict], baseline: dict[str, dict], tolerance: float
+) -> list[str]:
+    """Return a message for every benchmark slower than baseline * (1 + tolerance)."""
+    regressions = []
+    for key, result in results.items():
+        reference = baseline.get(key)
+        if reference is None:
+            continue
+        limit = reference["median_s"] * (1 + tolerance)
+        if result["median_s"] > limit:
+            regressions.append(
+                f"{key}: {result['median_s'] * 1000:.2f} ms "
+                f"(baseline {reference['median_s'] * 1000:.2f} ms)"
+            )
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="benchmarks", description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=list(SCENARIOS),
+        help="run only this scenario (repeatable)",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.25, help="allowed slowdown (0.25 = 25%%)"
+    )
+    parser.add_argument("--output", type=Path, help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    results = run(args.scenario or ["small", "medium"], args.repeat)
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+    if args.save_baseline:
+        baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+        baseline.update(results)
+        args.baseline.write_text(json.dumps(baseline, indent=2))
+        print(f"baseline saved to {args.baseline}")
+    if args.compare:
+        if not args.baseline.exists():
+            print(f"no baseline at {args.baseline}")
+            return 1
+        baseline = json.loads(args.baseline.read_text())
+        regressions = compare(results, baseline, args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        return 1 if regressions else 0
+    return 0
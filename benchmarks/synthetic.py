@@ -0,0 +1,72 @@
+"""Generate synthetic parties into SQLite files."""
+
+from __future__ import annotations
+
+import random
+from dataclasses import dataclass
+from pathlib import Path
+
+from alcal.menu import Menu, parse_menu_file
+from alcal.storage import DEFAULT_EVENT_ID, import_orders, init_db, open_connection
+
+DEFAULT_MENU_PATH = Path(__file__).resolve().parent.parent / "menus" / "default.json"
+
+
+@dataclass(frozen=True)
+class PartySpec:
+    """Shape of a synthetic event."""
+
+    name: str
+    participants: int
+    orders: int
+    min_share: int = 1
+    max_share: int = 6
+    # Orders are paid by one of the first ``payers`` guests; 0 leaves them unpaid.
+    payers: int = 0
+    seed: int = 0
+
+
+def load_default_menu() -> Menu:
+    return Menu(parse_menu_file(DEFAULT_MENU_PATH))
+
+
+def generate_party(path: Path, spec: PartySpec, menu: Menu | None = None) -> int:
+    """Write the party described by ``spec`` into a new database at ``path``.
+
+    Orders go through :func:`alcal.storage.import_orders`, so the balance
+    ledger is populated exactly as in the app. Returns the number of share rows.
+    """
+    menu = menu or load_default_menu()
+    rng = random.Random(spec.seed)
+    # Separate stream, so adding payers leaves the orders themselves unchanged.
+    payer_rng = random.Random(spec.seed + 1)
+    names = [f"guest{idx:04d}" for idx in range(spec.participants)]
+    drinks = [item["ドリンク"] for item in menu.items if item["価格"] is not None]
+
+    conn = open_connection(str(path))
+    try:
+        init_db(conn)
+        with conn:
+            conn.executemany(
+                "INSERT INTO participants (event_id, name) VALUES (?, ?)",
+                [(DEFAULT_EVENT_ID, name) for name in names],
+            )
+        rows = []
+        share_rows = 0
+        for _ in range(spec.orders):
+            size = rng.randint(spec.min_share, min(spec.max_share, spec.participants))
+            share_rows += size
+            rows.append(
+                {
+                    "drink": rng.choice(drinks),
+                    "quantity": str(rng.randint(1, 3)),
+                    "participants": "/".join(rng.sample(names, size)),
+                    "payer": payer_rng.choice(names[: spec.payers]) if spec.payers else "",
+                }
+            )
+        _, errors = import_orders(conn, DEFAULT_EVENT_ID, rows, menu)
+        if errors:
+            raise ValueError(errors[0])
+    finally:
+        conn.close()
+    return share_rows
@@ -0,0 +1,28 @@
+import pytest
+
+from alcal.storage import add_order, init_db, open_connection
+
+EVENT_ID = 1
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = open_connection(str(tmp_path / "drink_orders.db"))
+    init_db(conn)
+    yield conn
+    conn.close()
+
+
+def add_test_order(conn, drink_name, participant_ids):
+    """Record a 500-yen order of ``drink_name`` shared by ``participant_ids``."""
+    return add_order(
+        conn,
+        event_id=EVENT_ID,
+        drink_name=drink_name,
+        unit_price=500.0,
+        quantity=1,
+        memo="",
+        category="ビール",
+        input_mode="自由入力",
+        participant_ids=participant_ids,
+    )
@@ -0,0 +1,65 @@
+import sqlite3
+
+from alcal import cli, export
+from alcal.cli import _settle_to_file, main
+from alcal.storage import add_participant, init_db, open_connection
+
+
+def test_missing_database_is_not_created(tmp_path):
+    path = tmp_path / "missing.db"
+    assert main(["totals", str(path)]) == 1
+    assert not path.exists()
+
+
+def _database(tmp_path):
+    path = tmp_path / "drink_orders.db"
+    conn = open_connection(str(path))
+    init_db(conn)
+    add_participant(conn, 1, "a")
+    conn.close()
+    return path
+
+
+def test_parquet_export_without_pyarrow_fails_cleanly(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(export, "PARQUET_AVAILABLE", False)
+    path = _database(tmp_path)
+    args = ["export", str(path), "--format", "parquet", "-o", str(tmp_path / "out.parquet")]
+
+    assert main(args) == 1
+    assert "pyarrow" in capsys.readouterr().err
+
+
+def _settle_or_fail(path, output_dir):
+    if "malformed" in path:
+        raise KeyError("participant_id")
+    return _settle_to_file(path, output_dir)
+
+
+def test_batch_counts_a_failing_file_once(tmp_path, monkeypatch, capsys):
+    # Worker processes are forked, so they see the patched function.
+    monkeypatch.setattr(cli, "_settle_to_file", _settle_or_fail)
+    good = _database(tmp_path)
+    malformed = tmp_path / "malformed.db"
+    malformed.write_bytes(good.read_bytes())
+
+    assert main(["batch", str(good), str(malformed), "--output-dir", str(tmp_path / "out")]) == 1
+    out, err = capsys.readouterr()
+    assert str(good) in out
+    assert str(malformed) in err
+
+
+def test_reading_leaves_an_old_database_unchanged(tmp_path):
+    path = tmp_path / "drink_orders.db"
+    conn = open_connection(str(path))
+    init_db(conn)
+    add_participant(conn, 1, "a")
+    conn.execute("PRAGMA journal_mode = DELETE")
+    conn.execute("PRAGMA user_version = 0")
+    conn.close()
+    before = path.read_bytes()
+
+    assert main(["totals", str(path)]) == 0
+    assert path.read_bytes() == before
+    conn = sqlite3.connect(path)
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+    conn.close()
@@ -0,0 +1,67 @@
+import random
+
+from alcal.columnar import fetch_order_table, refresh_order_table
+from alcal.storage import (
+    add_participant,
+    amend_order,
+    fetch_changes,
+    fetch_participants,
+    latest_change_seq,
+    remove_participant,
+    undo_last_order_action,
+    void_order,
+)
+
+from conftest import EVENT_ID, add_test_order
+
+
+def _refresh(conn, orders, since):
+    """Apply the change log after ``since`` the way the app's snapshot does."""
+    touched = {
+        change["row_id"]
+        for change in fetch_changes(conn, EVENT_ID, since)
+        if change["table_name"] != "participants"
+    }
+    return refresh_order_table(conn, EVENT_ID, orders, touched)
+
+
+def test_refresh_keeps_order_voided_and_restored(conn):
+    for name in ("a", "b"):
+        add_participant(conn, EVENT_ID, name)
+    ids = [p["id"] for p in fetch_participants(conn, EVENT_ID)]
+    add_test_order(conn, "first", ids)
+    add_test_order(conn, "second", ids)
+    orders, since = fetch_order_table(conn, EVENT_ID), latest_change_seq(conn)
+
+    second_id = int(orders.order_ids[-1])
+    void_order(conn, EVENT_ID, second_id)
+    undo_last_order_action(conn, EVENT_ID)
+
+    refreshed = _refresh(conn, orders, since)
+    assert refreshed.order_ids.tolist() == orders.order_ids.tolist()
+    assert refreshed.to_dicts() == fetch_order_table(conn, EVENT_ID).to_dicts()
+
+
+def test_refresh_matches_full_reload(conn):
+    rng = random.Random(0)
+    for name in "abcdef":
+        add_participant(conn, EVENT_ID, name)
+    orders, since = fetch_order_table(conn, EVENT_ID), latest_change_seq(conn)
+    for step in range(200):
+        participant_ids = [p["id"] for p in fetch_participants(conn, EVENT_ID)]
+        order_ids = fetch_order_table(conn, EVENT_ID).order_ids.tolist()
+        action = rng.choice(("add", "add", "void", "undo", "amend", "remove"))
+        if action == "add" and participant_ids:
+            sharers = rng.sample(participant_ids, rng.randint(1, len(participant_ids)))
+            add_test_order(conn, f"drink{step}", sharers)
+        elif action == "void" and order_ids:
+            void_order(conn, EVENT_ID, rng.choice(order_ids))
+        elif action == "undo":
+            undo_last_order_action(conn, EVENT_ID)
+        elif action == "amend" and order_ids:
+            amend_order(conn, EVENT_ID, rng.choice(order_ids), quantity=rng.randint(1, 3))
+        elif action == "remove" and len(participant_ids) > 2:
+            remove_participant(conn, EVENT_ID, rng.choice(participant_ids))
+        if rng.random() < 0.3:
+            orders, since = _refresh(conn, orders, since), latest_change_seq(conn)
+            assert orders.to_dicts() == fetch_order_table(conn, EVENT_ID).to_dicts()
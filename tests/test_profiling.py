@@ -0,0 +1,13 @@
+import pytest
+
+from alcal.profiling import RerunProfiler, active_profiler
+
+
+def test_profiler_is_deactivated_when_the_run_raises():
+    profiler = RerunProfiler()
+    with pytest.raises(RuntimeError):
+        with profiler.activate():
+            assert active_profiler() is profiler
+            raise RuntimeError("rerun")
+    assert active_profiler() is None
+    assert profiler.finished is not None
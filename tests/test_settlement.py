@@ -0,0 +1,105 @@
+import random
+from functools import cache
+
+import numpy as np
+import pytest
+
+from alcal.settlement import (
+    EXACT_TRANSFER_LIMIT,
+    allocate_yen,
+    net_balances,
+    settle_transfers,
+)
+
+
+def _random_balances(rng, count, spread):
+    balances = [rng.choice([-1, 1]) * rng.randint(1, spread) for _ in range(count - 1)]
+    balances.append(-sum(balances))
+    return {pid: amount for pid, amount in enumerate(balances, start=1) if amount}
+
+
+def _apply(balances, transfers):
+    remaining = dict(balances)
+    for debtor, creditor, amount in transfers:
+        assert amount > 0
+        remaining[debtor] += amount
+        remaining[creditor] -= amount
+    return remaining
+
+
+def _fewest_transfers(balances):
+    """Brute force: people minus the most zero-sum groups they split into."""
+    amounts = list(balances.values())
+
+    @cache
+    def most_groups(mask):
+        if not mask:
+            return 0
+        lowest = mask & -mask
+        best = 0
+        rest = mask & ~lowest
+        sub = rest
+        while True:
+            group = sub | lowest
+            if sum(a for bit, a in enumerate(amounts) if group >> bit & 1) == 0:
+                best = max(best, 1 + most_groups(mask & ~group))
+            if not sub:
+                break
+            sub = (sub - 1) & rest
+        return best
+
+    return len(amounts) - most_groups((1 << len(amounts)) - 1)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_allocate_yen_sums_exactly(seed):
+    rng = np.random.default_rng(seed)
+    amounts = rng.uniform(0, 5000, size=rng.integers(1, 30))
+    total = round(amounts.sum())
+
+    yen = allocate_yen(amounts, total)
+
+    assert yen.sum() == total
+    assert np.all(np.abs(yen - amounts) < 1)
+
+
+def test_allocate_yen_splits_uneven_order():
+    assert allocate_yen(np.full(3, 1000 / 3), 1000).tolist() == [334, 333, 333]
+
+
+def test_net_balances_sum_to_zero():
+    rng = random.Random(0)
+    for _ in range(50):
+        paid = {pid: rng.uniform(0, 20000) for pid in range(1, 6) if rng.random() < 0.5}
+        owed_total = sum(paid.values())
+        weights = [rng.random() for _ in range(8)]
+        owed = {pid: owed_total * w / sum(weights) for pid, w in enumerate(weights, start=1)}
+
+        assert sum(net_balances(paid, owed).values()) == 0
+
+
+@pytest.mark.parametrize("seed", range(300))
+def test_transfers_are_minimal_for_small_groups(seed):
+    rng = random.Random(seed)
+    balances = _random_balances(rng, rng.randint(2, EXACT_TRANSFER_LIMIT), spread=6)
+
+    transfers = settle_transfers(balances)
+
+    assert not any(_apply(balances, transfers).values())
+    assert len(transfers) == _fewest_transfers(balances)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_large_groups_settle_within_one_less_than_people(seed):
+    rng = random.Random(seed)
+    balances = _random_balances(rng, rng.randint(EXACT_TRANSFER_LIMIT + 1, 60), spread=5000)
+
+    transfers = settle_transfers(balances)
+
+    assert not any(_apply(balances, transfers).values())
+    assert len(transfers) <= len(balances) - 1
+
+
+def test_unbalanced_input_is_rejected():
+    with pytest.raises(ValueError):
+        settle_transfers({1: 100, 2: -99})
@@ -0,0 +1,130 @@
+import pytest
+
+from alcal import storage
+from alcal.archive import close_event
+from alcal.menu import Menu
+from alcal.storage import (
+    CLOSED_EVENT_MESSAGE,
+    Database,
+    add_participant,
+    amend_order,
+    describe_last_order_action,
+    fetch_orders,
+    fetch_participants,
+    import_orders,
+    init_db,
+    remove_participant,
+    undo_last_order_action,
+    void_order,
+)
+
+from conftest import EVENT_ID, add_test_order
+
+
+def test_undo_skips_entries_invalidated_by_participant_removal(conn):
+    for name in ("a", "b", "c"):
+        add_participant(conn, EVENT_ID, name)
+    ids = {p["name"]: p["id"] for p in fetch_participants(conn, EVENT_ID)}
+    add_test_order(conn, "first", [ids["a"], ids["b"]])
+    add_test_order(conn, "second", [ids["c"]])
+    # Deletes "second" without a log entry.
+    remove_participant(conn, EVENT_ID, ids["c"])
+
+    assert describe_last_order_action(conn, EVENT_ID)[1] == "first の追加"
+    assert undo_last_order_action(conn, EVENT_ID) == (True, None)
+    assert fetch_orders(conn, EVENT_ID) == []
+    assert describe_last_order_action(conn, EVENT_ID) is None
+    assert undo_last_order_action(conn, EVENT_ID)[0] is False
+
+
+def test_migration_flags_entries_invalidated_before_upgrade(conn):
+    for name in ("a", "b"):
+        add_participant(conn, EVENT_ID, name)
+    ids = {p["name"]: p["id"] for p in fetch_participants(conn, EVENT_ID)}
+    add_test_order(conn, "first", [ids["a"]])
+    add_test_order(conn, "second", [ids["a"], ids["b"]])
+    remove_participant(conn, EVENT_ID, ids["b"])
+    # Roll back to a database from before removals flagged their entries.
+    conn.executescript(
+        """
+        DROP INDEX idx_order_log_undo_stack;
+        ALTER TABLE order_log DROP COLUMN invalidated;
+        PRAGMA user_version = 3;
+        """
+    )
+    init_db(conn)
+    assert describe_last_order_action(conn, EVENT_ID)[1] == "first の追加"
+
+
+def test_undo_refuses_when_another_write_came_first(conn):
+    add_participant(conn, EVENT_ID, "a")
+    participant_id = fetch_participants(conn, EVENT_ID)[0]["id"]
+    add_test_order(conn, "mine", [participant_id])
+    seq, label = describe_last_order_action(conn, EVENT_ID)
+    add_test_order(conn, "theirs", [participant_id])
+
+    ok, _ = undo_last_order_action(conn, EVENT_ID, seq)
+    assert not ok
+    assert sorted(o["drink_name"] for o in fetch_orders(conn, EVENT_ID)) == ["mine", "theirs"]
+    seq, label = describe_last_order_action(conn, EVENT_ID)
+    assert label == "theirs の追加"
+    assert undo_last_order_action(conn, EVENT_ID, seq) == (True, None)
+
+
+@pytest.mark.parametrize("unit_price", ["nan", "inf", "-inf"])
+def test_import_rejects_non_finite_prices(conn, unit_price):
+    add_participant(conn, EVENT_ID, "a")
+    rows = [{"drink": "ビール", "unit_price": unit_price}]
+
+    imported, errors = import_orders(conn, EVENT_ID, rows, Menu({}))
+
+    assert imported == 0
+    assert errors == ["2行目: 数量または単価が数値ではありません。"]
+    assert fetch_orders(conn, EVENT_ID) == []
+
+
+def test_writer_prunes_change_log_periodically(tmp_path, monkeypatch):
+    pruned = []
+    monkeypatch.setattr(storage, "CHANGE_LOG_PRUNE_INTERVAL", 10)
+    monkeypatch.setattr(storage, "prune_changes", pruned.append)
+    db = Database(str(tmp_path / "drink_orders.db"))
+    for i in range(25):
+        with db.writer() as conn:
+            init_db(conn)
+            add_participant(conn, EVENT_ID, f"p{i}")
+    assert len(pruned) == 2
+
+
+def test_reader_sees_one_snapshot(tmp_path):
+    db = Database(str(tmp_path / "drink_orders.db"))
+    with db.writer() as conn:
+        init_db(conn)
+    with db.reader() as reader:
+        before = fetch_participants(reader, EVENT_ID)
+        with db.writer() as conn:
+            add_participant(conn, EVENT_ID, "late")
+        assert fetch_participants(reader, EVENT_ID) == before
+    with db.reader() as reader:
+        assert [p["name"] for p in fetch_participants(reader, EVENT_ID)] == ["late"]
+
+
+def test_closed_event_rejects_writes(conn, tmp_path):
+    add_participant(conn, EVENT_ID, "a")
+    participant_id = fetch_participants(conn, EVENT_ID)[0]["id"]
+    add_test_order(conn, "before close", [participant_id])
+    order_id = fetch_orders(conn, EVENT_ID)[0]["id"]
+    assert close_event(conn, EVENT_ID, tmp_path / "archive.db") == (True, None)
+
+    rejected = (False, CLOSED_EVENT_MESSAGE)
+    assert add_participant(conn, EVENT_ID, "b") == rejected
+    assert add_test_order(conn, "after close", [participant_id]) == rejected
+    assert remove_participant(conn, EVENT_ID, participant_id) == rejected
+    assert void_order(conn, EVENT_ID, order_id) == rejected
+    assert amend_order(conn, EVENT_ID, order_id, quantity=2) == rejected
+    assert undo_last_order_action(conn, EVENT_ID) == rejected
+    assert import_orders(conn, EVENT_ID, [{"drink": "x", "unit_price": "500"}], Menu({})) == (
+        0,
+        [CLOSED_EVENT_MESSAGE],
+    )
+    assert conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM participants").fetchone()[0] == 0